@@ -6,216 +6,575 @@ Provides endpoints to trigger crowd counting and check status
 
 import os
 import sys
-import json
+import hashlib
+import re
+import collections
+import fcntl
+import selectors
 import subprocess
 import threading
 import time
+import multiprocessing
 import psycopg2
-from datetime import datetime
-from flask import Flask, jsonify, request
+import psycopg2.pool
+from dataclasses import dataclass, replace
+from datetime import date, datetime
+from typing import Optional
+from flask import Flask, g, request
+from flask.json.provider import DefaultJSONProvider
 import logging
 import mailtrap as mt
+import orjson
+
+# main.py and its modules live under src/
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(APP_DIR, "src")
+sys.path.insert(0, SRC_DIR)
+# The forkserver is a fresh interpreter that ignores this sys.path (CPython 3.11
+# drops the sys_path it is handed), so it finds api and src/ through the environment
+_pythonpath = [p for p in os.environ.get("PYTHONPATH", "").split(os.pathsep) if p]
+os.environ["PYTHONPATH"] = os.pathsep.join(
+    [APP_DIR, SRC_DIR] + [p for p in _pythonpath if p not in (APP_DIR, SRC_DIR)]
+)
+import launcher
+from modules.database import ATTENDANCE_UPSERT_SQL, SERVICE_COLUMNS
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, used for request bodies and app.json responses"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of decoding to str and re-encoding
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+
+STDOUT_FD = sys.stdout.fileno()  # Child output is mirrored here with os.write
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+
+
+def json_response(payload, status=200):
+    """Build a JSON response encoded with orjson (faster than Flask's jsonify)"""
+    return app.response_class(orjson.dumps(payload), status=status, mimetype="application/json")
+
+
+# Counting runs are forked from a forkserver that imports main.py (torch,
+# ultralytics, OpenCV) once, instead of starting a fresh interpreter per run.
+# Each run child still re-executes this file as __mp_main__; preloading api
+# keeps that to the module body, with Flask, mailtrap and psycopg2 already imported.
+RUN_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+RUN_CONTEXT.set_forkserver_preload(["api", "main", "launcher"])
+
+
+@dataclass(frozen=True)
+class RunState:
+    """Status of the current or last run; replaced as a whole, never mutated"""
+    status: str = "idle"
+    last_run: Optional[str] = None
+    count: Optional[int] = None  # Last crowd count result
+    version: int = 0  # Bumped on every change; used for ETags and cached bodies
 
-# Global variables to track running processes
+
+# Global variables to track running processes.
+# This state is process-local: the API must be served by a single process
+# (scale with API_THREADS, not with extra worker processes).
 current_process = None
-process_status = "idle"
-last_run = None
-process_output = []
-last_count_result = None  # Store the last crowd count result
+run_state = RunState()  # Read once per request into a local; swapped atomically by writers
+BOOT_ID = os.urandom(4).hex()  # Prefixes ETags: versions restart at 0 with the process
+process_output = collections.deque(maxlen=int(os.getenv("LOG_LINES", "2000")))  # Most recent output lines
+output_lock = threading.RLock()  # Guards process_output together with its version
+output_version = 0  # Bumped on every process_output change
+_output_cache = (-1, b"[]")  # (output_version, orjson-encoded process_output)
+state_lock = threading.Lock()  # Serializes writers of run_state; readers take no lock
+
+# Mailtrap client shared by /email requests instead of one per send
+EMAIL_API = os.getenv("EMAIL_API", "")
+_mail_client = None
+_mail_client_lock = threading.Lock()
+BATCH_SEND = hasattr(mt, "BatchSendEmailParams")  # Batch sending API, mailtrap SDK 2.1+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+MAX_RECIPIENTS = int(os.getenv("MAX_RECIPIENTS", "500"))  # Per /email request
+
+# PostgreSQL connection pool shared by request threads, created on first use
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class UpdateState:
+    """Status of the current or last /update; replaced as a whole, never mutated"""
+    status: str = "idle"
+    started_at: Optional[str] = None
+    exit_code: Optional[int] = None
+
+
+APP_DIR = "/app"  # Container checkout that /update pulls into
+UPDATE_SCRIPT = os.path.join(APP_DIR, "update.py")
+current_update = UpdateState()
+update_lock = threading.Lock()  # Serializes writers of current_update
+update_log = bytearray()  # Raw output of the most recent /update, served by /update/log
+
+# Kernel buffer for child output pipes (default 64 KiB); capped by /proc/sys/fs/pipe-max-size
+PIPE_SIZE = 1 << 20
+
+# Matches main.py's final "Total people counted: N" line in raw output
+COUNT_RE = re.compile(rb"Total people counted:\s*(\d+)")
+
+# Static response bodies, encoded once at import
+HOME_BODY = orjson.dumps({
+    "service": "crowd-counter-api",
+    "status": "healthy",
+    "version": "2.0",
+    "endpoints": {
+        "/start": "GET - Start crowd counting",
+        "/status": "GET - Check process status",
+        "/logs": "GET - Get recent logs",
+        "/logs/stream": "GET - Stream recent logs as NDJSON",
+        "/health": "GET - Health check",
+        "/update": "GET - Start an update from GitHub",
+        "/update/status": "GET - Check update status",
+        "/update/log": "GET - Raw output of the last update",
+        "/email": "POST - Send email with custom receiver(s) or default from .env",
+        "/db/update": "POST - Run crowd counting and update PostgreSQL attendance table",
+        "/db/update_bulk": "POST - Write several attendance counts in one transaction",
+        "/count": "GET - Get last count result",
+        "/run": "POST - Run crowd counting with options"
+    }
+})
+HOME_ETAG = hashlib.sha1(HOME_BODY).hexdigest()
+HEALTH_PREFIX = b'{"status":"healthy",'
+
+# (epoch second, ISO string) for now_iso(); swapped as one tuple so readers never see a torn pair
+_timestamp_cache = (0, "")
+
+
+def now_iso():
+    """Current local time as an ISO-8601 string, cached at one-second resolution"""
+    global _timestamp_cache
+    now = int(time.time())
+    cached_at, cached_iso = _timestamp_cache
+    if cached_at != now:
+        cached_iso = datetime.fromtimestamp(now).isoformat()
+        _timestamp_cache = (now, cached_iso)
+    return cached_iso
+
+
+# Short-lived response bodies for polled endpoints: name -> (version, expires_at, body)
+_body_cache = {}
+STATUS_CACHE_TTL = 2  # seconds, /status and /health
+LOGS_CACHE_TTL = 5  # seconds, /logs
+
+
+def cached_body(name, version, ttl, build):
+    """
+    Return the cached body for name, calling build() to refresh it once it
+    is older than ttl seconds or the state version it was built from changed.
+    """
+    now = time.monotonic()
+    entry = _body_cache.get(name)
+    if entry and entry[0] == version and entry[1] > now:
+        return entry[2]
+    body = build()
+    _body_cache[name] = (version, now + ttl, body)
+    return body
+
+
+def append_output(line):
+    """Append a line to process_output and invalidate the encoded /logs cache"""
+    global output_version
+    with output_lock:
+        process_output.append(line)
+        output_version += 1
+
+
+def extend_output(lines):
+    """Append a batch of lines under one lock acquisition"""
+    global output_version
+    with output_lock:
+        process_output.extend(lines)
+        output_version += 1
+
+
+def reset_output():
+    """Clear process_output at the start of a run"""
+    global output_version
+    with output_lock:
+        process_output.clear()
+        output_version += 1
+
+
+def encoded_output():
+    """Return process_output as JSON bytes, re-encoding only after it changes"""
+    global _output_cache
+    with output_lock:
+        if _output_cache[0] != output_version:
+            _output_cache = (output_version, orjson.dumps(list(process_output)))
+        return _output_cache[1]
+
+
+def not_modified(tag, weak=False):
+    """Return a 304 response if the client already holds the (unquoted) ETag tag, else None"""
+    if weak:
+        matched = request.if_none_match.contains_weak(tag)
+    else:
+        matched = request.if_none_match.contains(tag)
+    if matched:
+        response = app.response_class(status=304)
+        response.set_etag(tag, weak=weak)
+        return response
+    return None
+
+
+def get_mail_client():
+    """Return the shared Mailtrap client, creating it on first use; None without EMAIL_API"""
+    global _mail_client
+    if not EMAIL_API:
+        return None
+    with _mail_client_lock:
+        if _mail_client is None:
+            _mail_client = mt.MailtrapClient(token=EMAIL_API)
+        return _mail_client
+
+
+def get_db_pool():
+    """Return the shared PostgreSQL connection pool, creating it on first use"""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = psycopg2.pool.ThreadedConnectionPool(
+                1, 4,
+                host=os.getenv("DB_HOST", "localhost"),
+                port=int(os.getenv("DB_PORT", "5432")),
+                database=os.getenv("DB_NAME", "crowd_counter"),
+                user=os.getenv("DB_USER", "postgres"),
+                password=os.getenv("DB_PASS", ""),
+                sslmode=os.getenv("DB_SSLMODE", "prefer")
+            )
+        return _db_pool
+
+
+def stream_output(fd, prefix, source, sink=None, raw_sink=None):
+    """
+    Mirror a child's output pipe (fd) to the terminal and log.
+
+    Each chunk's lines go to sink as a list of str, and/or to raw_sink as
+    newline-terminated bytes when the caller only needs the raw log.
+    Returns the number of bytes read, for a one-line summary log.
+    """
+    # Wait on the pipe with a selector and pull whole 64 KiB blocks with a
+    # non-blocking os.read; select releases the GIL while idle, so request
+    # threads keep running while the child streams output
+    os.set_blocking(fd, False)
+    pending = bytearray()
+    total = 0
+    mirror_prefix = f"[{prefix}] ".encode()
+    log_lines = logger.isEnabledFor(logging.DEBUG)
+
+    def emit(raws):
+        raws = [raw.strip() for raw in raws]
+        # Mirror the whole chunk to the Docker terminal with one unbuffered write
+        os.write(STDOUT_FD, b"".join(mirror_prefix + raw + b"\n" for raw in raws))
+        if raw_sink:
+            raw_sink(b"\n".join(raws) + b"\n")
+        if sink or log_lines:
+            output_lines = [raw.decode("utf-8", errors="replace") for raw in raws]
+            if log_lines:
+                for output_line in output_lines:
+                    logger.debug(f"{source}: {output_line}")
+            if sink:
+                sink(output_lines)
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            if not selector.select(timeout=0.1):
+                continue
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                continue  # Spurious wakeup; nothing to read yet
+            if not chunk:
+                break  # EOF: the child closed its end of the pipe
+            total += len(chunk)
+            pending += chunk
+            end = pending.rfind(b"\n")
+            if end >= 0:
+                # Only complete lines are split and decoded; the tail stays buffered
+                emit(bytes(pending[:end]).split(b"\n"))
+                del pending[:end + 1]
+    if pending:
+        emit([bytes(pending)])
+    return total
+
+
+def find_count(output):
+    """Return the last "Total people counted" value in raw output bytes, or None"""
+    count = None
+    for match in COUNT_RE.finditer(output):
+        count = int(match.group(1))
+    return count
+
+
+def grow_pipe(fd):
+    """Enlarge a pipe's kernel buffer so a chatty child blocks on write less often (Linux only)"""
+    try:
+        fcntl.fcntl(fd, getattr(fcntl, "F_SETPIPE_SZ", 1031), PIPE_SIZE)
+    except OSError as e:
+        logger.debug(f"Could not resize pipe: {e}")
+
+
+def build_args(hour=None, send_email=False, email_receivers=None):
+    """Build main.py command-line arguments for the requested options"""
+    args = []
+    if hour:
+        args.extend(["--hour", hour])
+    if send_email:
+        args.append("--send-email")
+    if email_receivers:
+        args.extend(["--email-receivers", email_receivers])
+    return args
+
+
+def start_counter(args):
+    """
+    Start main.py in a child forked from the preloaded forkserver.
+
+    Returns (process, output) where output is the read end of a pipe that
+    carries the child's combined stdout/stderr; close it when done.
+    """
+    output, child_output = RUN_CONTEXT.Pipe(duplex=False)
+    grow_pipe(output.fileno())
+    process = RUN_CONTEXT.Process(target=launcher.run_main, args=(args, child_output))
+    process.start()
+    child_output.close()  # Only the child writes; lets the pump see EOF when it exits
+    return process, output
+
 
 def run_crowd_counter_and_get_count(hour=None, send_email=False, email_receivers=None):
     """Run the crowd counting script and return the total count"""
     try:
         logger.info("Starting crowd counting process for database update...")
 
-        # Build command arguments
-        cmd = [sys.executable, "src/main.py"]
-        if hour:
-            cmd.extend(["--hour", hour])
-        if send_email:
-            cmd.append("--send-email")
-        if email_receivers:
-            cmd.extend(["--email-receivers", email_receivers])
-
-        # Run the main script and capture output
-        process = subprocess.Popen(
-            cmd,
-            cwd=os.getcwd(),  # Use current working directory
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
+        process, output = start_counter(build_args(hour, send_email, email_receivers))
 
         # Collect all output
-        output_lines = []
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                output_line = output.strip()
-                print(f"[CROWD-COUNTER] {output_line}")
-                logger.info(f"main.py: {output_line}")
-                output_lines.append(output_line)
+        raw_output = bytearray()
+        try:
+            produced = stream_output(output.fileno(), "CROWD-COUNTER", "main.py", raw_sink=raw_output.extend)
+        finally:
+            output.close()
 
         # Wait for process to complete
-        return_code = process.wait()
+        process.join()
+        return_code = process.exitcode
+        logger.info(f"main.py produced {produced} bytes, exit={return_code}")
 
         if return_code != 0:
             raise Exception(f"Crowd counting failed with exit code {return_code}")
 
         # Extract total count from output (look for "Total people counted: X")
-        for line in output_lines:
-            if "Total people counted:" in line:
-                try:
-                    count_part = line.split("Total people counted:")[-1].strip()
-                    count = int(count_part)
-                    logger.info(f"Extracted total count: {count}")
-                    return count
-                except (ValueError, IndexError):
-                    logger.warning(f"Could not parse count from line: {line}")
-
-        raise Exception("Could not find total count in output")
+        count = find_count(raw_output)
+        if count is None:
+            raise Exception("Could not find total count in output")
+        logger.info(f"Extracted total count: {count}")
+        return count
 
     except Exception as e:
         logger.error(f"Failed to run crowd counter: {str(e)}")
         raise e
 
 
+def claim_run():
+    """Atomically move from not-running to running; False if a run is already in progress"""
+    global run_state
+    with state_lock:
+        if run_state.status == "running":
+            return False
+        run_state = replace(
+            run_state,
+            status="running",
+            last_run=datetime.now().isoformat(),
+            version=run_state.version + 1
+        )
+        return True
+
+
+def update_state(**changes):
+    """Publish a new RunState with the given fields changed"""
+    global run_state
+    with state_lock:
+        run_state = replace(run_state, version=run_state.version + 1, **changes)
+
+
+def set_status(status):
+    """Record the outcome of the current run"""
+    update_state(status=status)
+
+
 def run_crowd_counter(hour=None, send_email=False, email_receivers=None):
-    """Run the crowd counting script in a separate thread"""
-    global current_process, process_status, last_run, process_output
+    """Run the crowd counting script in a separate thread (after claim_run() succeeded)"""
+    global current_process
 
+    process = None
     try:
-        process_status = "running"
-        last_run = datetime.now().isoformat()
-        process_output = []
+        reset_output()
 
         logger.info("Starting crowd counting process...")
 
-        # Build command arguments
-        cmd = [sys.executable, "src/main.py"]
-        if hour:
-            cmd.extend(["--hour", hour])
-        if send_email:
-            cmd.append("--send-email")
-        if email_receivers:
-            cmd.extend(["--email-receivers", email_receivers])
-
         # Run the main script with real-time output streaming
-        current_process = subprocess.Popen(
-            cmd,
-            cwd=os.getcwd(),  # Use current working directory
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,  # Line buffered
-            universal_newlines=True
-        )
-
-        # Stream output in real-time
-        output_lines = []
-        while True:
-            output = current_process.stdout.readline()
-            if output == '' and current_process.poll() is not None:
-                break
-            if output:
-                output_line = output.strip()
-                print(f"[CROWD-COUNTER] {output_line}")  # Print to terminal
-                logger.info(f"main.py: {output_line}")     # Also log it
-                output_lines.append(output_line)
+        process, output = start_counter(build_args(hour, send_email, email_receivers))
+        current_process = process
+        raw_output = bytearray()
+        try:
+            produced = stream_output(output.fileno(), "CROWD-COUNTER", "main.py", extend_output, raw_output.extend)
+        finally:
+            output.close()
 
         # Wait for process to complete and get return code
-        return_code = current_process.wait()
+        process.join()
+        return_code = process.exitcode
+        logger.info(f"main.py produced {produced} bytes, exit={return_code}")
 
-        # Store the output for API access
-        process_output = output_lines
-        process_output.append(f"Exit code: {return_code}")
+        append_output(f"Exit code: {return_code}")
 
         # Extract total count from output
-        global last_count_result
-        last_count_result = None
-        for line in output_lines:
-            if "Total people counted:" in line:
-                try:
-                    # Extract number after "Total people counted:"
-                    count_part = line.split("Total people counted:")[-1].strip()
-                    last_count_result = int(count_part)
-                    logger.info(f"Extracted total count: {last_count_result}")
-                    break
-                except (ValueError, IndexError):
-                    logger.warning(f"Could not parse count from line: {line}")
+        count = find_count(raw_output)
+        update_state(count=count)
+        if count is not None:
+            logger.info(f"Extracted total count: {count}")
 
         if return_code == 0:
-            process_status = "completed"
+            set_status("completed")
             logger.info("Crowd counting completed successfully")
         else:
-            process_status = "failed"
+            set_status("failed")
             logger.error(f"Crowd counting failed with code {return_code}")
 
-    except subprocess.TimeoutExpired:
-        if current_process:
-            current_process.kill()
-        process_status = "timeout"
-        logger.error("Crowd counting process timed out")
     except Exception as e:
-        if current_process:
-            current_process.kill()
-        process_status = "error"
-        process_output.append(f"Error: {str(e)}")
+        if process:
+            process.kill()
+        set_status("error")
+        append_output(f"Error: {str(e)}")
         logger.error(f"Error running crowd counter: {e}")
     finally:
         current_process = None
 
+
+def claim_update():
+    """Atomically mark an update as running; False if one is already in progress"""
+    global current_update
+    with update_lock:
+        if current_update.status == "running":
+            return False
+        current_update = UpdateState(status="running", started_at=now_iso())
+        return True
+
+
+def finish_update(status, exit_code=None):
+    """Record the outcome of the current update"""
+    global current_update
+    with update_lock:
+        current_update = replace(current_update, status=status, exit_code=exit_code)
+
+
+def run_update():
+    """Run update.py (git pull + pip install) in a background thread after claim_update() succeeded"""
+    try:
+        logger.info("Starting Git update process...")
+        update_log.clear()
+
+        # Keep the arguments posix_spawn-eligible (absolute script path, no
+        # close_fds, cwd only when needed) so the child doesn't fork our heap
+        process = subprocess.Popen(
+            [sys.executable, UPDATE_SCRIPT],
+            cwd=None if os.getcwd() == APP_DIR else APP_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            close_fds=False,  # Safe: Python creates descriptors non-inheritable
+            bufsize=0  # Raw pipe; stream_output reads the descriptor directly
+        )
+
+        grow_pipe(process.stdout.fileno())
+
+        # Stream output in real-time; the raw log is kept as bytes for /update/log
+        produced = stream_output(process.stdout.fileno(), "UPDATE", "update.py", raw_sink=update_log.extend)
+        return_code = process.wait()
+        logger.info(f"update.py produced {produced} bytes, exit={return_code}")
+
+        if return_code == 0:
+            finish_update("completed", return_code)
+            logger.info("Git update completed successfully - restart container if needed")
+        else:
+            finish_update("failed", return_code)
+            logger.error(f"Git update failed with code {return_code}")
+
+    except Exception as e:
+        finish_update("error")
+        update_log.extend(f"Error: {e}\n".encode())
+        logger.error(f"Error during Git update: {e}")
+
+@app.before_request
+def stamp_request():
+    """Take the request's start time and response timestamp once, up front"""
+    g.start_ns = time.perf_counter_ns()
+    g.timestamp = now_iso()
+
+@app.after_request
+def add_response_time(response):
+    """Report how long the handler took, in microseconds"""
+    if "start_ns" in g:
+        response.headers["X-Response-Time-Us"] = str((time.perf_counter_ns() - g.start_ns) // 1000)
+    return response
+
 @app.route("/")
 def home():
     """Health check endpoint"""
-    return jsonify({
-        "service": "crowd-counter-api",
-        "status": "healthy",
-        "version": "2.0",
-        "endpoints": {
-            "/start": "GET - Start crowd counting",
-            "/status": "GET - Check process status",
-            "/logs": "GET - Get recent logs",
-            "/health": "GET - Health check",
-            "/update": "GET - Update from GitHub",
-            "/email": "POST - Send email with custom receiver(s) or default from .env",
-            "/db/update": "POST - Run crowd counting and update PostgreSQL attendance table",
-            "/count": "GET - Get last count result",
-            "/run": "POST - Run crowd counting with options"
-        }
-    })
+    response = not_modified(HOME_ETAG) or app.response_class(HOME_BODY, mimetype="application/json")
+    response.set_etag(HOME_ETAG)
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return response
 
 @app.route("/health")
 def health():
     """Detailed health check"""
-    return jsonify({
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "process_status": process_status,
-        "last_run": last_run,
-        "uptime": time.time()
-    })
+    state = run_state
+
+    def build():
+        dynamic = orjson.dumps({
+            "timestamp": g.timestamp,
+            "process_status": state.status,
+            "last_run": state.last_run,
+            "uptime": time.time()
+        })
+        # Splice the per-request fields onto the pre-encoded constant prefix
+        return HEALTH_PREFIX + dynamic[1:]
+
+    body = cached_body("health", state.version, STATUS_CACHE_TTL, build)
+    return app.response_class(body, mimetype="application/json")
 
 @app.route("/start", methods=["GET"])
 def start_crowd_counting():
     """Start the crowd counting process"""
-    global current_process, process_status
-    
-    if process_status == "running":
-        return jsonify({
+    if not claim_run():
+        state = run_state
+        return json_response({
             "error": "Process already running",
-            "status": process_status,
-            "started_at": last_run
+            "status": state.status,
+            "started_at": state.last_run
         }), 409
     
     # Start the process in a separate thread
@@ -223,55 +582,85 @@ def start_crowd_counting():
     thread.daemon = True
     thread.start()
     
-    return jsonify({
+    return json_response({
         "message": "Crowd counting started",
         "status": "running", 
-        "started_at": datetime.now().isoformat()
+        "started_at": run_state.last_run
     })
 
 @app.route("/status")
 def get_status():
     """Get current process status"""
-    return jsonify({
-        "status": process_status,
-        "last_run": last_run,
-        "timestamp": datetime.now().isoformat()
-    })
+    state = run_state
+    etag = f"{BOOT_ID}-{state.version}"
+    cached = not_modified(etag, weak=True)
+    if cached:
+        return cached
+    body = cached_body("status", state.version, STATUS_CACHE_TTL, lambda: orjson.dumps({
+        "status": state.status,
+        "last_run": state.last_run,
+        "timestamp": g.timestamp
+    }))
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    return response
 
 @app.route("/logs")
 def get_logs():
     """Get process logs"""
-    return jsonify({
-        "status": process_status,
-        "last_run": last_run,
-        "output": process_output,
-        "timestamp": datetime.now().isoformat()
-    })
+    state = run_state
+    version = (state.version, output_version)
+    etag = f"{BOOT_ID}-{state.version}-{output_version}"
+    cached = not_modified(etag, weak=True)
+    if cached:
+        return cached
+
+    def build():
+        body = orjson.dumps({
+            "status": state.status,
+            "last_run": state.last_run,
+            "timestamp": g.timestamp
+        })
+        return body[:-1] + b',"output":' + encoded_output() + b"}"
+
+    body = cached_body("logs", version, LOGS_CACHE_TTL, build)
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    return response
+
+@app.route("/logs/stream")
+def stream_logs():
+    """Stream process logs as newline-delimited JSON, one line per record"""
+    with output_lock:
+        lines = list(process_output)
+
+    def generate():
+        for line in lines:
+            yield orjson.dumps(line) + b"\n"
+
+    return app.response_class(generate(), mimetype="application/x-ndjson")
 
 @app.route("/count")
 def get_last_count():
     """Get the last crowd count result"""
-    return jsonify({
-        "last_count": last_count_result,
-        "last_run": last_run,
-        "process_status": process_status,
-        "timestamp": datetime.now().isoformat()
+    state = run_state
+    return json_response({
+        "last_count": state.count,
+        "last_run": state.last_run,
+        "process_status": state.status,
+        "timestamp": g.timestamp
     })
 
 @app.route("/run", methods=["POST"])
 def run_with_options():
     """Run crowd counting with custom options"""
-    global current_process, process_status
-
-    if process_status == "running":
-        return jsonify({
-            "error": "Process already running",
-            "status": process_status,
-            "started_at": last_run
-        }), 409
-
     try:
-        data = request.get_json() or {}
+        data = request.get_json(force=True, silent=True)
+        if data is None and request.get_data():
+            return json_response({
+                "error": "Request body is not valid JSON"
+            }), 400
+        data = data or {}
 
         # Extract options
         hour = data.get('hour')
@@ -279,12 +668,20 @@ def run_with_options():
         email_receivers = data.get('email_receivers')
 
         # Validate hour if provided
-        if hour and hour not in ['9am', '1045am']:
-            return jsonify({
-                "error": "Invalid hour. Must be '9am' or '1045am'",
+        if hour and (not isinstance(hour, str) or hour not in SERVICE_COLUMNS):
+            return json_response({
+                "error": f"Invalid hour. Must be one of: {', '.join(SERVICE_COLUMNS)}",
                 "provided": hour
             }), 400
 
+        if not claim_run():
+            state = run_state
+            return json_response({
+                "error": "Process already running",
+                "status": state.status,
+                "started_at": state.last_run
+            }), 409
+
         # Start the process in a separate thread with options
         thread = threading.Thread(
             target=run_crowd_counter,
@@ -293,7 +690,7 @@ def run_with_options():
         thread.daemon = True
         thread.start()
 
-        return jsonify({
+        return json_response({
             "message": "Crowd counting started with options",
             "options": {
                 "hour": hour,
@@ -301,21 +698,25 @@ def run_with_options():
                 "email_receivers": email_receivers
             },
             "status": "running",
-            "started_at": datetime.now().isoformat()
+            "started_at": run_state.last_run
         })
 
     except Exception as e:
-        return jsonify({
+        return json_response({
             "error": f"Failed to start process: {str(e)}",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": g.timestamp
         }), 500
 
 @app.route("/email", methods=["POST"])
 def send_custom_email():
     """Send email with custom receiver(s) or default from environment"""
     try:
-        data = request.get_json()
-        
+        data = request.get_json(force=True, silent=True)
+        if data is None and request.get_data():
+            return json_response({
+                "error": "Request body is not valid JSON"
+            }), 400
+
         # Get receivers - either from API request or environment default
         receivers = []
         if data and 'receiver' in data:
@@ -325,15 +726,28 @@ def send_custom_email():
                 # Split by comma and clean up whitespace
                 receivers = [email.strip() for email in receiver_input.split(',') if email.strip()]
             elif isinstance(receiver_input, list):
-                receivers = receiver_input
+                receivers = [email.strip() for email in receiver_input if isinstance(email, str) and email.strip()]
         else:
             # Use default from environment
             default_receiver = os.getenv("EMAIL_RECEIVER", "")
             if default_receiver:
                 receivers = [email.strip() for email in default_receiver.split(',') if email.strip()]
         
+        # Drop duplicates (keeping order) and reject malformed or excessive lists before calling Mailtrap
+        receivers = list(dict.fromkeys(receivers))
+        invalid = [email for email in receivers if not EMAIL_RE.match(email)]
+        if invalid:
+            return json_response({
+                "error": "Invalid email address(es)",
+                "invalid": invalid[:20]
+            }), 400
+        if len(receivers) > MAX_RECIPIENTS:
+            return json_response({
+                "error": f"Too many receivers ({len(receivers)}); the limit is {MAX_RECIPIENTS}"
+            }), 400
+
         if not receivers:
-            return jsonify({
+            return json_response({
                 "error": "No receivers specified. Set EMAIL_RECEIVER in environment or pass 'receiver' in request body",
                 "example": {
                     "receiver": "user@example.com,user2@example.com"
@@ -346,117 +760,112 @@ def send_custom_email():
         
         # Get email configuration from environment
         email_sender = os.getenv("EMAIL_SENDER", "no-reply@example.org")
-        email_api = os.getenv("EMAIL_API", "")
-        
-        if not email_api:
-            return jsonify({
+        mail_client = get_mail_client()
+        if mail_client is None:
+            return json_response({
                 "error": "Email API key not configured",
                 "note": "Set EMAIL_API environment variable"
             }), 500
         
-        # Convert receivers to Mailtrap Address objects
-        recipient_addresses = [mt.Address(email=email) for email in receivers]
-        
-        # Send email via Mailtrap
-        mail = mt.Mail(
-            sender=mt.Address(email=email_sender, name="Crowd Counter API"),
-            to=recipient_addresses,
-            subject=subject,
-            text=message,
-            category="API Notification"
-        )
-        
-        client = mt.MailtrapClient(token=email_api)
-        response = client.send(mail)
+        sender = mt.Address(email=email_sender, name="Crowd Counter API")
+        if BATCH_SEND:
+            # One message per recipient, sent in a single batch request
+            response = mail_client.batch_send(mt.BatchSendEmailParams(
+                base=mt.BatchMail(
+                    sender=sender,
+                    subject=subject,
+                    text=message,
+                    category="API Notification"
+                ),
+                requests=[mt.BatchEmailRequest(to=[mt.Address(email=email)]) for email in receivers]
+            ))
+            # The batch endpoint answers 200 even when messages fail; results follow request order
+            failed = [
+                {"recipient": email, "errors": result.get("errors") or []}
+                for email, result in zip(receivers, response.get("responses") or [])
+                if not result.get("success")
+            ]
+            if failed or not response.get("success"):
+                logger.error(f"Batch email failed: {response.get('errors')}; failed recipients: {failed}")
+                return json_response({
+                    "error": "Failed to send email to some recipients",
+                    "errors": response.get("errors") or [],
+                    "failed": failed,
+                    "timestamp": g.timestamp
+                }), 500
+        else:
+            # Older SDKs without batch support: one message addressed to everyone
+            mail = mt.Mail(
+                sender=sender,
+                to=[mt.Address(email=email) for email in receivers],
+                subject=subject,
+                text=message,
+                category="API Notification"
+            )
+            mail_client.send(mail)
         
         logger.info(f"Email sent successfully to {len(receivers)} recipient(s): {', '.join(receivers)}")
-        return jsonify({
+        return json_response({
             "message": f"Email sent successfully to {len(receivers)} recipient(s)",
             "recipients": receivers,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": g.timestamp
         })
         
     except Exception as e:
         logger.error(f"Failed to send email: {str(e)}")
-        return jsonify({
+        return json_response({
             "error": f"Failed to send email: {str(e)}",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": g.timestamp
         }), 500
 
 @app.route("/update", methods=["GET"])
 def update_from_git():
-    """Update the application from GitHub"""
-    try:
-        logger.info("Starting Git update process...")
-        
-        # Run the update script with real-time output streaming
-        process = subprocess.Popen(
-            [sys.executable, "update.py"],
-            cwd="/app",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
-        
-        # Stream output in real-time
-        output_lines = []
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                output_line = output.strip()
-                print(f"[UPDATE] {output_line}")  # Print to Docker terminal
-                logger.info(f"update.py: {output_line}")  # Also log it
-                output_lines.append(output_line)
-        
-        # Wait for process to complete
-        return_code = process.wait()
-        
-        if return_code == 0:
-            logger.info("Git update completed successfully")
-            return jsonify({
-                "message": "Update completed successfully (includes git pull + pip install)",
-                "status": "success",
-                "output": output_lines,
-                "timestamp": datetime.now().isoformat(),
-                "note": "Code updated and requirements installed - restart container if needed"
-            })
-        else:
-            logger.error(f"Git update failed with code {return_code}")
-            return jsonify({
-                "error": "Update failed",
-                "status": "failed",
-                "exit_code": return_code,
-                "output": output_lines,
-                "timestamp": datetime.now().isoformat()
-            }), 500
-            
-    except subprocess.TimeoutExpired:
-        logger.error("Git update process timed out")
-        return jsonify({
-            "error": "Update process timed out",
-            "status": "timeout",
-            "timestamp": datetime.now().isoformat()
-        }), 408
-    except Exception as e:
-        logger.error(f"Error during Git update: {e}")
-        return jsonify({
-            "error": f"Update failed: {str(e)}",
-            "status": "error",
-            "timestamp": datetime.now().isoformat()
-        }), 500
+    """Start updating the application from GitHub in the background"""
+    if not claim_update():
+        state = current_update
+        return json_response({
+            "error": "Update already running",
+            "status": state.status,
+            "started_at": state.started_at
+        }), 409
+
+    thread = threading.Thread(target=run_update)
+    thread.daemon = True
+    thread.start()
+
+    return json_response({
+        "message": "Update started (git pull + pip install)",
+        "status": "started",
+        "poll": "/update/status",
+        "log_url": "/update/log",
+        "started_at": current_update.started_at
+    }), 202
+
+@app.route("/update/status")
+def get_update_status():
+    """Get the status of the current or last update"""
+    state = current_update
+    return json_response({
+        "status": state.status,
+        "started_at": state.started_at,
+        "exit_code": state.exit_code,
+        "log_url": "/update/log",
+        "timestamp": g.timestamp
+    })
+
+@app.route("/update/log")
+def get_update_log():
+    """Raw output of the most recent update as plain text"""
+    return app.response_class(bytes(update_log), mimetype="text/plain")
 
 @app.route("/db/update", methods=["POST"])
 def update_database():
     """Run crowd counting and update PostgreSQL attendance table"""
     try:
-        data = request.get_json()
+        data = request.get_json(force=True, silent=True)
 
         if not data:
-            return jsonify({
+            return json_response({
                 "error": "Missing request body",
                 "example": {
                     "service": "9am"
@@ -468,7 +877,7 @@ def update_database():
 
         # Validate service parameter
         if not service:
-            return jsonify({
+            return json_response({
                 "error": "Missing 'service' parameter",
                 "example": {
                     "service": "9am"
@@ -476,9 +885,9 @@ def update_database():
             }), 400
 
         # Validate service type
-        if service not in ['9am', '1045am']:
-            return jsonify({
-                "error": "Invalid service. Must be '9am' or '1045am'",
+        if not isinstance(service, str) or service not in SERVICE_COLUMNS:
+            return json_response({
+                "error": f"Invalid service. Must be one of: {', '.join(SERVICE_COLUMNS)}",
                 "provided": service
             }), 400
 
@@ -486,100 +895,182 @@ def update_database():
         try:
             count = run_crowd_counter_and_get_count(hour=service)
         except Exception as e:
-            return jsonify({
+            return json_response({
                 "error": f"Failed to run crowd counting: {str(e)}",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": g.timestamp
             }), 500
 
-        # Get database configuration from environment
-        db_config = {
-            "host": os.getenv("DB_HOST", "localhost"),
-            "port": int(os.getenv("DB_PORT", "5432")),
-            "name": os.getenv("DB_NAME", "crowd_counter"),
-            "user": os.getenv("DB_USER", "postgres"),
-            "password": os.getenv("DB_PASS", "")
-        }
-
-        # Connect to PostgreSQL database
+        # Borrow a connection from the shared PostgreSQL pool
         try:
-            conn = psycopg2.connect(
-                host=db_config["host"],
-                port=db_config["port"],
-                database=db_config["name"],
-                user=db_config["user"],
-                password=db_config["password"]
-            )
+            db_pool = get_db_pool()
+            conn = db_pool.getconn()
             cursor = conn.cursor()
         except Exception as e:
-            return jsonify({
+            return json_response({
                 "error": f"Database connection failed: {str(e)}",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": g.timestamp
             }), 500
 
         try:
             # Get current date in MM/DD/YYYY format
-            current_date = datetime.now().strftime('%m/%d/%Y')
-
-            # Check if record for today exists
-            cursor.execute(
-                "SELECT date FROM attendance WHERE date = %s",
-                (current_date,)
-            )
-            existing_record = cursor.fetchone()
-
-            # Determine column name
-            column_name = "service_9am_sanctuary" if service == "9am" else "service_1045am_sanctuary"
+            current_date = date.today().strftime('%m/%d/%Y')
 
-            if existing_record:
-                # Update existing record
-                cursor.execute(
-                    f"UPDATE attendance SET {column_name} = %s WHERE date = %s",
-                    (count, current_date)
-                )
-                action = "updated"
-                record_info = f"existing record for {current_date}"
-            else:
-                # Insert new record
-                cursor.execute(
-                    f"INSERT INTO attendance (date, {column_name}) VALUES (%s, %s)",
-                    (current_date, count)
-                )
+            # Insert today's record or update the existing one in a single statement
+            cursor.execute(ATTENDANCE_UPSERT_SQL[service], (current_date, count))
+            if cursor.fetchone()[0]:
                 action = "inserted"
                 record_info = f"new record for {current_date}"
+            else:
+                action = "updated"
+                record_info = f"existing record for {current_date}"
 
             conn.commit()
 
             logger.info(f"Database record {action} for {service} service: {count} attendees on {current_date}")
-            return jsonify({
+            return json_response({
                 "message": f"Service count {action} successfully",
                 "date": current_date,
                 "service": service,
                 "count": count,
                 "record_info": record_info,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": g.timestamp
             })
 
         finally:
-            conn.close()
+            # The pool rolls back unfinished transactions and drops lost connections
+            db_pool.putconn(conn)
 
     except psycopg2.Error as e:
         logger.error(f"Database error: {str(e)}")
-        return jsonify({
+        return json_response({
             "error": f"Database error: {str(e)}",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": g.timestamp
         }), 500
     except Exception as e:
         logger.error(f"Failed to update database: {str(e)}")
-        return jsonify({
+        return json_response({
             "error": f"Failed to update database: {str(e)}",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": g.timestamp
         }), 500
 
+@app.route("/db/update_bulk", methods=["POST"])
+def update_database_bulk():
+    """Write several attendance counts to PostgreSQL in a single transaction"""
+    example = {
+        "records": [
+            {"date": "01/05/2025", "service": "9am", "count": 250},
+            {"date": "01/05/2025", "service": "1045am", "count": 310}
+        ]
+    }
+    try:
+        data = request.get_json(force=True, silent=True)
+        records = data.get('records') if isinstance(data, dict) else None
+
+        if not records or not isinstance(records, list):
+            return json_response({
+                "error": "Missing 'records' list",
+                "example": example
+            }), 400
+
+        # Validate every record before touching the database
+        rows = []
+        for index, record in enumerate(records):
+            try:
+                service = record['service']
+                record_date = datetime.strptime(record['date'], '%m/%d/%Y').strftime('%m/%d/%Y')
+                count = record['count']
+            except (KeyError, TypeError, ValueError):
+                return json_response({
+                    "error": "Each record needs 'date' (MM/DD/YYYY), 'service' and 'count'",
+                    "index": index,
+                    "example": example
+                }), 400
+            # bool is an int subclass; JSON true/false is not a head count
+            if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+                return json_response({
+                    "error": "'count' must be a non-negative integer",
+                    "index": index,
+                    "provided": count
+                }), 400
+            if not isinstance(service, str) or service not in SERVICE_COLUMNS:
+                return json_response({
+                    "error": f"Invalid service. Must be one of: {', '.join(SERVICE_COLUMNS)}",
+                    "index": index,
+                    "provided": service
+                }), 400
+            rows.append((service, record_date, count))
+
+        db_pool = get_db_pool()
+        conn = db_pool.getconn()
+        try:
+            inserted = updated = 0
+            with conn.cursor() as cursor:
+                for service, record_date, count in rows:
+                    cursor.execute(ATTENDANCE_UPSERT_SQL[service], (record_date, count))
+                    if cursor.fetchone()[0]:
+                        inserted += 1
+                    else:
+                        updated += 1
+            # One commit for the whole batch
+            conn.commit()
+        finally:
+            db_pool.putconn(conn)
+
+        logger.info(f"Bulk attendance update: {inserted} inserted, {updated} updated")
+        return json_response({
+            "message": f"{len(rows)} service count(s) written successfully",
+            "inserted": inserted,
+            "updated": updated,
+            "timestamp": g.timestamp
+        })
+
+    except psycopg2.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return json_response({
+            "error": f"Database error: {str(e)}",
+            "timestamp": g.timestamp
+        }), 500
+    except Exception as e:
+        logger.error(f"Failed to update database: {str(e)}")
+        return json_response({
+            "error": f"Failed to update database: {str(e)}",
+            "timestamp": g.timestamp
+        }), 500
+
+
+def warmup():
+    """Move one-time startup costs ahead of the first request that would pay them"""
+    # Start the forkserver now so main.py's imports happen at boot, not on the first run.
+    # A failed preload is silent in the forkserver, so fork one probe to confirm it.
+    if RUN_CONTEXT.get_start_method() == "forkserver":
+        logger.info("Preloading crowd counter in the forkserver...")
+        probe = RUN_CONTEXT.Process(target=launcher.check_preload)
+        probe.start()
+        probe.join()
+        if probe.exitcode == 0:
+            logger.info("Forkserver ready with main.py preloaded")
+        else:
+            logger.warning("Forkserver could not preload main.py; each run will import it cold")
+
+    # Open the PostgreSQL pool up front so the first /db/update doesn't pay for the connect
+    try:
+        get_db_pool()
+    except psycopg2.Error as e:
+        logger.warning(f"Database not reachable at startup, will retry on first use: {e}")
+
+    # Build the shared Mailtrap client and exercise the JSON encoders once
+    get_mail_client()
+    orjson.dumps({"warmup": True})
+    app.json.loads(b'{"warmup": true}')
+
+
 if __name__ == "__main__":
+    from waitress import serve
+
     port = int(os.getenv("API_PORT", "8000"))
-    debug = os.getenv("API_DEBUG", "false").lower() == "true"
+    threads = int(os.getenv("API_THREADS", "16"))
 
-    logger.info(f"Starting Crowd Counter API on port {port}")
+    logger.info(f"Starting Crowd Counter API on port {port} ({threads} threads)")
     logger.info("Available endpoints:")
     logger.info("  GET  /         - Service info")
     logger.info("  GET  /health   - Health check")
@@ -589,8 +1080,13 @@ if __name__ == "__main__":
     logger.info("  GET  /count    - Get last count result")
     logger.info("  POST /email    - Send email with custom receiver")
     logger.info("  POST /db/update - Run crowd counting and update PostgreSQL attendance table")
-    logger.info("  GET  /update   - Update from GitHub")
+    logger.info("  POST /db/update_bulk - Write several attendance counts in one transaction")
+    logger.info("  GET  /update   - Start an update from GitHub")
+    logger.info("  GET  /update/status - Update status")
+    logger.info("  GET  /update/log - Update output")
     logger.info("  GET  /status   - Process status")
     logger.info("  GET  /logs     - Process logs")
+    logger.info("  GET  /logs/stream - Process logs as NDJSON")
 
-    app.run(host="0.0.0.0", port=port, debug=debug)
\ No newline at end of file
+    warmup()
+    serve(app, host="0.0.0.0", port=port, threads=threads, connection_limit=1000)
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""Child-process entry point used by the API server to run the pipeline.
+
+The API starts runs from a forkserver that has already imported ``main``
+(and with it torch, ultralytics and OpenCV), so each run forks a warm
+interpreter instead of starting ``python src/main.py`` from scratch.
+This module stays import-light so the API process never loads those
+dependencies itself.
+"""
+import os
+import sys
+
+
+def run_main(argv, output):
+    """
+    Run the crowd counter with stdout/stderr sent to ``output``.
+
+    Args:
+        argv: Command-line arguments for main.py (without the program name)
+        output: Write end of a multiprocessing Pipe the API reads from
+    """
+    os.dup2(output.fileno(), 1)
+    os.dup2(output.fileno(), 2)
+    output.close()
+    # Flush per line so the API can stream progress while the run is going
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stderr.reconfigure(line_buffering=True)
+
+    import main  # Already imported by the forkserver preload
+
+    raise SystemExit(main.run(argv))
+
+
+def check_preload():
+    """Exit 0 if ``main`` came with the fork, i.e. the forkserver preload worked."""
+    raise SystemExit(0 if "main" in sys.modules else 1)
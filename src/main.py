@@ -2,9 +2,10 @@
 import argparse
 import logging
 import os
-import shutil
+import queue
 import sys
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from multiprocessing import Queue, cpu_count
 import multiprocessing
 
@@ -12,7 +13,11 @@ import multiprocessing
 from modules import (
     PTZCameraController,
     capture_all_presets,
+    export_model,
+    use_in_process_worker,
+    capture_handler,
     start_processing_workers,
+    send_stop_signals,
     stop_workers,
     collect_results,
     Config,
@@ -21,22 +26,102 @@ from modules import (
     update_attendance_from_last_run
 )
 
+# Directory holding this script and the modules package
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # ---------------------------------------------------------------------------
 # Logging Setup
 # ---------------------------------------------------------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler("ptz_capture.log")
-    ]
-)
 logger = logging.getLogger(__name__)
 
 
-def main():
-    """Main orchestration function."""
+def setup_logging():
+    """
+    Log to stdout and ptz_capture.log.
+
+    force=True replaces whatever handlers the process already has: a run
+    forked from the API's forkserver inherits api.py's basicConfig, which
+    would otherwise make this call a no-op.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler("ptz_capture.log")
+        ],
+        force=True
+    )
+
+
+def configure_multiprocessing():
+    """
+    Pick the start method for worker processes.
+
+    On Linux a forkserver imports torch, ultralytics and OpenCV once and
+    forks each worker from it, instead of every spawned worker re-importing
+    them. Elsewhere (e.g. macOS) stay with spawn.
+
+    The forkserver is a fresh interpreter that ignores this process's
+    sys.path (CPython 3.11), so src/ is handed to it through PYTHONPATH.
+    Workers also re-execute the parent's main script as __mp_main__;
+    preloading that script by name leaves them only its module body to run.
+    """
+    if sys.platform.startswith("linux"):
+        pythonpath = [p for p in os.environ.get("PYTHONPATH", "").split(os.pathsep) if p]
+        if SRC_DIR not in pythonpath:
+            os.environ["PYTHONPATH"] = os.pathsep.join([SRC_DIR] + pythonpath)
+        preload = ["modules.processing"]
+        main_file = getattr(sys.modules["__main__"], "__file__", None)
+        if main_file:
+            preload.insert(0, os.path.splitext(os.path.basename(main_file))[0])
+        multiprocessing.set_start_method("forkserver", force=True)
+        multiprocessing.set_forkserver_preload(preload)
+    else:
+        multiprocessing.set_start_method("spawn", force=True)
+
+
+def start_file_logging():
+    """
+    Move the root logger's file handler behind a QueueListener thread.
+
+    Log calls then only enqueue the record and the listener does the disk
+    writes. Console output stays synchronous so the API streams it live.
+    Worker processes pass their records through the same queue (see
+    process_image_worker).
+
+    Returns:
+        tuple: (log_queue, listener)
+    """
+    root = logging.getLogger()
+    file_handlers = [h for h in root.handlers if isinstance(h, logging.FileHandler)]
+    for handler in file_handlers:
+        root.removeHandler(handler)
+
+    log_queue = Queue()
+    root.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *file_handlers, respect_handler_level=True)
+    listener.start()
+    return log_queue, listener
+
+
+def stop_file_logging(listener):
+    """Flush queued records to the log file and restore the direct file handler."""
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(handler)
+    listener.stop()
+    for handler in listener.handlers:
+        root.addHandler(handler)
+
+
+def main(argv=None, log_queue=None):
+    """
+    Main orchestration function. Returns the report dict from generate_report.
+
+    log_queue, if given, is the queue from start_file_logging; worker
+    processes log to the file through it.
+    """
     # Parse arguments
     parser = argparse.ArgumentParser(
         description='PTZ Crowd Counter - Automated people counting system',
@@ -64,7 +149,7 @@ Examples:
         choices=['9am', '1045am'],
         help='Service hour for attendance tracking (9am or 1045am)'
     )
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     # Validate configuration
     logger.info("Validating configuration...")
@@ -97,42 +182,50 @@ Examples:
     )
     
     # Multiprocessing setup
-    try:
-        multiprocessing.set_start_method("spawn")
-    except RuntimeError:
-        pass  # Already set
+    configure_multiprocessing()
     
-    image_queue = Queue()
-    result_queue = Queue()
     num_workers = min(cpu_count(), Config.NUM_WORKERS)
+    in_process = use_in_process_worker(num_workers)
+    if in_process:
+        # Single in-process worker thread: plain queues, no pickling
+        image_queue = queue.Queue()
+        result_queue = queue.Queue()
+    else:
+        image_queue = Queue()
+        result_queue = Queue()
     
     # Start processing workers
     logger.info(f"Starting {num_workers} processing workers...")
     model_config = Config.get_model_config()
+    model_path = export_model(
+        model_config["path"], Config.MODEL_EXPORT_FORMAT, model_config["batch_size"],
+        Config.MODEL_INT8_DATA
+    )
     workers = start_processing_workers(
         num_workers, image_queue, result_queue,
-        model_config["path"], output_dir,
+        model_path, output_dir,
         model_config["conf"], model_config["iou"],
-        model_config["cluster_eps"], model_config["min_cluster_size"]
+        model_config["cluster_eps"], model_config["min_cluster_size"],
+        model_config["batch_size"], in_process, log_queue
     )
     
-    # Capture images
+    # Capture images, queuing each snapshot for processing as soon as it is taken
     logger.info("Starting image capture...")
-    captured_images, failed_presets = capture_all_presets(controller, presets, output_dir)
+    captured_images, failed_presets = capture_all_presets(
+        controller, presets, output_dir,
+        on_capture=capture_handler(image_queue, in_process)
+    )
+    controller.close()
     
     if failed_presets:
         logger.warning(f"⚠️  Failed to capture {len(failed_presets)} preset(s): {failed_presets}")
     logger.info(f"Capture complete: {len(captured_images)} successful, {len(failed_presets)} failed")
     
-    # Queue images for processing
-    logger.info("Queuing images for processing...")
-    for image_path in captured_images:
-        image_queue.put(image_path)
-    
-    # Stop workers and collect results
+    # Stop workers and collect results; the stop signals queue behind the captures
     logger.info("Processing images with YOLO model...")
-    stop_workers(workers, image_queue, num_workers)
-    results = collect_results(result_queue)
+    send_stop_signals(workers, image_queue)
+    results = collect_results(result_queue, len(captured_images), workers)
+    stop_workers(workers)
     logger.info(f"Processing complete: {len(results)} results collected")
     
     # Generate report
@@ -156,13 +249,6 @@ Examples:
     else:
         logger.warning("Failed to update attendance database")
     
-    # Cleanup raw images
-    logger.info(" Cleaning up temporary files...")
-    raw_dir = os.path.join(output_dir, "raw_images")
-    if os.path.exists(raw_dir):
-        shutil.rmtree(raw_dir, ignore_errors=True)
-        logger.info(f"   Removed raw images directory")
-    
     # Final summary
     logger.info("=" * 60)
     logger.info(f"Run {run_id} completed successfully!")
@@ -176,13 +262,27 @@ Examples:
         logger.warning(f"Email: Failed to send")
     logger.info("=" * 60)
 
+    return report
 
-if __name__ == "__main__":
+
+def run(argv=None):
+    """Run main() and turn failures into a process exit code."""
+    setup_logging()
+    # The log queue must be created under the start method the workers use
+    configure_multiprocessing()
+    log_queue, listener = start_file_logging()
     try:
-        main()
+        main(argv, log_queue)
     except KeyboardInterrupt:
         logger.warning("\n  Process interrupted by user")
-        sys.exit(1)
+        return 1
     except Exception as e:
         logger.error(f"❌ Fatal error: {str(e)}", exc_info=True)
-        sys.exit(1)
+        return 1
+    finally:
+        stop_file_logging(listener)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -1,20 +1,38 @@
-"""Modules package for PTZ Crowd Counter."""
+"""Modules package for PTZ Crowd Counter.
 
-from .camera_controller import PTZCameraController
-from .capture import capture_all_presets
-from .processing import start_processing_workers, stop_workers, collect_results
-from .config import Config, PresetConfig
-from .reporting import generate_report
-from .database import update_attendance_from_last_run
+Exports are resolved lazily (PEP 562), so importing one submodule or just
+Config doesn't drag in torch, ultralytics or psycopg2 with the rest.
+"""
+import importlib
 
-__all__ = [
-    "PTZCameraController",
-    "capture_all_presets",
-    "start_processing_workers",
-    "stop_workers",
-    "collect_results",
-    "Config",
-    "PresetConfig",
-    "generate_report",
-    "update_attendance_from_last_run"
-]
\ No newline at end of file
+# Public name -> submodule that defines it
+_EXPORTS = {
+    "PTZCameraController": "camera_controller",
+    "capture_all_presets": "capture",
+    "export_model": "processing",
+    "use_in_process_worker": "processing",
+    "capture_handler": "processing",
+    "start_processing_workers": "processing",
+    "send_stop_signals": "processing",
+    "stop_workers": "processing",
+    "collect_results": "processing",
+    "Config": "config",
+    "PresetConfig": "config",
+    "generate_report": "reporting",
+    "update_attendance_from_last_run": "database"
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value  # Cache so later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
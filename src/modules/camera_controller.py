@@ -2,11 +2,36 @@
 import logging
 import socket
 import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 from .config import Config, PresetConfig
 
 
 logger = logging.getLogger(__name__)
 
+# VISCA reply header byte and message types (high nibble of the second byte)
+VISCA_REPLY = 0x90
+VISCA_ACK = 0x40
+VISCA_COMPLETION = 0x50
+VISCA_ERROR = 0x60
+
+# VISCA error codes (third byte of an error reply)
+VISCA_ERRORS = {
+    0x02: "Syntax Error",
+    0x03: "Command Buffer Full",
+    0x04: "Command Canceled",
+    0x05: "No Socket",
+    0x41: "Command Not Executable"
+}
+
+# VISCA "memory recall" command for every valid preset, built once
+RECALL_COMMANDS = {
+    n: bytes([0x81, 0x01, 0x04, 0x3F, 0x02, n & 0xFF, 0xFF])
+    for n in range(1, 257)
+}
+
 
 class PTZCameraController:
     """Controller for sending VISCA over IP commands to the PTZ camera."""
@@ -17,86 +42,132 @@ class PTZCameraController:
         self.camera_pass = camera_pass
         self.visca_port = visca_port
         self.socket_timeout = 15.0
+        self._sock = None  # Persistent VISCA connection, opened on first command
+
+        # Keep-alive HTTP session for snapshots, with the Basic auth header
+        # built once. Connection errors, timeouts and 5xx are retried twice
+        # with exponential backoff; anything else goes straight to the caller.
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(camera_user, camera_pass)
+        retry = Retry(
+            total=2,
+            backoff_factor=0.3,
+            status_forcelist=[500, 502, 503, 504],
+            raise_on_status=False
+        )
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry))
         logger.info(f"Initialized PTZ Controller for {camera_ip}:{visca_port}")
 
+    def _ensure_connected(self):
+        """Return the VISCA socket, connecting it if needed."""
+        if self._sock is None:
+            logger.debug(f"Connecting to {self.camera_ip}:{self.visca_port}")
+            sock = socket.create_connection((self.camera_ip, self.visca_port), timeout=self.socket_timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._sock = sock
+        return self._sock
+
+    def _drain(self, sock):
+        """Discard replies left over from an earlier command (e.g. a late completion)."""
+        sock.setblocking(False)
+        try:
+            while sock.recv(1024):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            sock.settimeout(self.socket_timeout)
+
+    def close(self):
+        """Close the VISCA connection and the snapshot session; both reopen on next use."""
+        self._disconnect()
+        self.session.close()
+
+    def _disconnect(self):
+        """Close the VISCA connection; the next command reconnects."""
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except Exception:
+                pass
+            self._sock = None
+
     def send_visca_command(self, command_bytes, description=""):
         """
         Send a VISCA command to the camera with retries.
+        The connection is kept open between commands and reopened after a failure.
+        Only network errors back off before retrying; an unexpected reply
+        reconnects and retries at once.
         Returns True on success, False on failure.
         """
-        sock = None
         max_retries = 2
 
         for attempt in range(max_retries):
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(self.socket_timeout)
+                sock = self._ensure_connected()
+                self._drain(sock)
 
-                logger.debug(f"Attempt {attempt + 1}: Connecting to {self.camera_ip}:{self.visca_port}")
-                sock.connect((self.camera_ip, self.visca_port))
-
-                command_hex = " ".join(f"{b:02X}" for b in command_bytes)
-                logger.debug(f"Sending VISCA command ({description}): {command_hex}")
+                debug = logger.isEnabledFor(logging.DEBUG)
+                if debug:
+                    logger.debug(f"Sending VISCA command ({description}): {command_bytes.hex(' ').upper()}")
                 sock.send(command_bytes)
 
                 response = sock.recv(1024)
                 if response:
-                    response_hex = " ".join(f"{b:02X}" for b in response)
-                    logger.debug(f"Received response: {response_hex}")
+                    if debug:
+                        logger.debug(f"Received response: {response.hex(' ').upper()}")
 
-                    if len(response) >= 3 and response[0] == 0x90:
-                        high = response[1] & 0xF0
-                        if high == 0x40:  # ACK
+                    if len(response) >= 3 and response[0] == VISCA_REPLY:
+                        kind = response[1] & 0xF0
+                        if kind == VISCA_ACK:
                             logger.debug("Command acknowledged, waiting for completion...")
                             try:
                                 completion = sock.recv(1024)
                                 if completion:
-                                    comp_hex = " ".join(f"{b:02X}" for b in completion)
-                                    logger.debug(f"Completion response: {comp_hex}")
-                                    if (completion[1] & 0xF0) == 0x50:  # Completion
+                                    if debug:
+                                        logger.debug(f"Completion response: {completion.hex(' ').upper()}")
+                                    if (completion[1] & 0xF0) == VISCA_COMPLETION:
                                         logger.debug("Command completed successfully")
                                         return True
                             except socket.timeout:
                                 logger.warning("Timeout waiting for completion message")
                                 return True  # Assume success after ACK
-                        elif high == 0x50:  # Immediate completion
+                        elif kind == VISCA_COMPLETION:  # Immediate completion
                             logger.debug("Command completed immediately")
                             return True
-                        elif high == 0x60:  # Error
-                            error_code = response[2] if len(response) > 2 else 0
-                            error_msg = {
-                                0x02: "Syntax Error",
-                                0x03: "Command Buffer Full",
-                                0x04: "Command Canceled",
-                                0x05: "No Socket",
-                                0x41: "Command Not Executable"
-                            }.get(error_code, f"Unknown Error ({error_code:02X})")
+                        elif kind == VISCA_ERROR:
+                            error_code = response[2]
+                            error_msg = VISCA_ERRORS.get(error_code, f"Unknown Error ({error_code:02X})")
                             logger.error(f"VISCA Error: {error_msg}")
                             return False
                 logger.warning(f"Unexpected or no response on attempt {attempt + 1}")
+                self._disconnect()  # The camera may have dropped the connection; reconnect on retry
             except socket.timeout:
+                self._disconnect()
                 logger.warning(f"Socket timeout on attempt {attempt + 1}")
                 if attempt == max_retries - 1:
                     logger.error(f"Failed to send command after {max_retries} attempts")
                     return False
+                time.sleep(self._retry_delay(attempt))
             except Exception as e:
+                self._disconnect()
                 logger.error(f"Socket error on attempt {attempt + 1}: {str(e)}")
                 if attempt == max_retries - 1:
                     logger.error(f"Failed after {max_retries} attempts")
                     return False
-            finally:
-                if sock:
-                    try:
-                        sock.close()
-                    except Exception:
-                        pass
-            time.sleep(1)
+                if isinstance(e, OSError):  # e.g. connection refused/reset
+                    time.sleep(self._retry_delay(attempt))
         return False
 
+    @staticmethod
+    def _retry_delay(attempt):
+        """Backoff before retrying after a network error: 0.1s, 0.2s, 0.4s, ... capped at 1s."""
+        return min(1.0, 0.1 * 2 ** attempt)
+
     def recall_preset(self, preset_number):
         """Recall a preset position (1-256)."""
-        if not 1 <= preset_number <= 256:
+        command = RECALL_COMMANDS.get(preset_number)
+        if command is None:
             logger.error(f"Invalid preset number: {preset_number}. Must be 1-256.")
             return False
-        command = bytes([0x81, 0x01, 0x04, 0x3F, 0x02, preset_number & 0xFF, 0xFF])
         return self.send_visca_command(command, f"Recall Preset {preset_number}")
@@ -1,6 +1,5 @@
 """Image capture logic for PTZ camera presets."""
 import logging
-import os
 import time
 import requests
 from .config import Config, PresetConfig
@@ -9,7 +8,7 @@ from .config import Config, PresetConfig
 logger = logging.getLogger(__name__)
 
 
-def capture_image(controller, preset_number, preset_name, output_dir, max_retries=3):
+def capture_image(controller, preset_number, preset_name, output_dir):
     """
     Capture image for a given preset using HTTP snapshot.
     
@@ -18,10 +17,13 @@ def capture_image(controller, preset_number, preset_name, output_dir, max_retrie
         preset_number: Preset number to recall
         preset_name: Human-readable preset name
         output_dir: Base output directory
-        max_retries: Number of capture attempts
     
+    Transient failures (connection errors, timeouts, 5xx) are retried with
+    backoff by the controller's HTTP session; other statuses fail at once.
+
     Returns:
-        str: Path to captured image, or None on failure
+        bytes: JPEG bytes of the snapshot, or None on failure. The snapshot
+            is kept in memory rather than written to disk.
     """
     logger.info(f"Recalling preset {preset_number} ({preset_name})")
     
@@ -29,56 +31,34 @@ def capture_image(controller, preset_number, preset_name, output_dir, max_retrie
         logger.error(f"Failed to recall preset {preset_number}")
         return None
     
-    time.sleep(1)  # Allow camera to move/stabilize
+    time.sleep(Config.PRESET_SETTLE_TIME)  # Allow camera to move/stabilize
     
-    raw_image_path = os.path.join(
-        output_dir,
-        "raw_images",
-        f"preset_{preset_number:03d}_{preset_name.replace(' ', '_')}.jpg"
-    )
-    os.makedirs(os.path.dirname(raw_image_path), exist_ok=True)
-
     snapshot_url = f"http://{controller.camera_ip}/snapshot.jpg"
 
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Capturing image for preset {preset_number} (Attempt {attempt + 1}/{max_retries})")
-            response = requests.get(
-                snapshot_url,
-                auth=(controller.camera_user, controller.camera_pass),
-                timeout=10
-            )
-            if response.status_code == 200:
-                with open(raw_image_path, "wb") as f:
-                    f.write(response.content)
-                logger.info(f"Captured image for preset {preset_number} at {raw_image_path}")
-                return raw_image_path
-            else:
-                logger.error(
-                    f"Failed to capture image for preset {preset_number}: "
-                    f"HTTP {response.status_code} (Attempt {attempt + 1}/{max_retries})"
-                )
-                if attempt == max_retries - 1:
-                    logger.error(
-                        f"Failed to capture image for preset {preset_number} after {max_retries} attempts"
-                    )
-                    return None
-        except requests.exceptions.RequestException as e:
-            logger.error(
-                f"Error capturing image for preset {preset_number}: {str(e)} "
-                f"(Attempt {attempt + 1}/{max_retries})"
-            )
-            if attempt == max_retries - 1:
+    try:
+        logger.info(f"Capturing image for preset {preset_number}")
+        # Streamed so an error status is reported without downloading its body
+        with controller.session.get(
+            snapshot_url,
+            headers={"Accept": "image/jpeg"},
+            timeout=(3, 10),
+            stream=True
+        ) as response:
+            if response.status_code != 200:
                 logger.error(
-                    f"Failed to capture image for preset {preset_number} after {max_retries} attempts"
+                    f"Failed to capture image for preset {preset_number}: HTTP {response.status_code}"
                 )
                 return None
-        time.sleep(0.5)
-    
-    return None
+            jpeg_bytes = response.content
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error capturing image for preset {preset_number}: {str(e)}")
+        return None
 
+    logger.info(f"Captured image for preset {preset_number} ({len(jpeg_bytes)} bytes)")
+    return jpeg_bytes
 
-def capture_all_presets(controller, presets, output_dir):
+
+def capture_all_presets(controller, presets, output_dir, on_capture=None):
     """
     Capture images for all presets.
     
@@ -86,18 +66,27 @@ def capture_all_presets(controller, presets, output_dir):
         controller: PTZCameraController instance
         presets: List of (preset_number, preset_name) tuples
         output_dir: Base output directory
+        on_capture: Optional callback given each (preset_number, preset_name,
+            jpeg_bytes) capture as soon as it is taken, so processing can
+            start while the camera moves on
     
     Returns:
-        tuple: (captured_images list, failed_presets list)
+        tuple: (captured preset numbers list, failed_presets list)
     """
     captured_images = []
     failed_presets = []
 
+    # Presets are captured one at a time: there is one physical camera, and
+    # a snapshot taken while it moves to the next preset shows the wrong
+    # view. Processing still overlaps capture through on_capture.
+
     for preset_number, preset_name in presets:
         try:
-            image_path = capture_image(controller, preset_number, preset_name, output_dir)
-            if image_path:
-                captured_images.append(image_path)
+            jpeg_bytes = capture_image(controller, preset_number, preset_name, output_dir)
+            if jpeg_bytes:
+                captured_images.append(preset_number)
+                if on_capture:
+                    on_capture((preset_number, preset_name, jpeg_bytes))
             else:
                 failed_presets.append(preset_number)
         except Exception as e:
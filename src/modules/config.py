@@ -1,8 +1,9 @@
 """Configuration management for PTZ Crowd Counter."""
-import json
 import logging
 import os
 import sys
+import types
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +19,19 @@ except ImportError:
     logger.warning("⚠️ Using default values or system environment variables")
 
 
+# Where Ultralytics writes each supported export format, relative to the .pt
+# path without its extension; MODEL_EXPORT_FORMAT must be one of these
+EXPORT_SUFFIXES = {
+    "torchscript": ".torchscript",
+    "onnx": ".onnx",
+    "openvino": "_openvino_model",
+    "engine": ".engine",
+    "paddle": "_paddle_model",
+    "mnn": ".mnn",
+    "ncnn": "_ncnn_model"
+}
+
+
 class Config:
     """Central configuration for the crowd counter application."""
     
@@ -26,9 +40,12 @@ class Config:
     VISCA_PORT = int(os.getenv("VISCA_PORT", "5678"))
     CAMERA_USER = os.getenv("CAMERA_USER", "admin")
     CAMERA_PASS = os.getenv("CAMERA_PASS", "admin")
+    PRESET_SETTLE_TIME = float(os.getenv("PRESET_SETTLE_TIME", "1.0"))  # Seconds to wait after a preset recall
     
     # Model Settings
     MODEL_PATH = os.getenv("MODEL_PATH", "models/best.pt")
+    MODEL_EXPORT_FORMAT = os.getenv("MODEL_EXPORT_FORMAT", "")  # e.g. engine, openvino, onnx
+    MODEL_INT8_DATA = os.getenv("MODEL_INT8_DATA", "")  # Calibration dataset YAML for INT8 exports
     INFER_CONF = float(os.getenv("INFER_CONF", "0.25"))
     INFER_IOU = float(os.getenv("INFER_IOU", "0.45"))
     
@@ -38,6 +55,8 @@ class Config:
     
     # Processing Settings
     NUM_WORKERS = int(os.getenv("NUM_WORKERS", "4"))
+    BATCH_SIZE = int(os.getenv("BATCH_SIZE", "4"))  # Images per YOLO predict call
+    DECODE_SCALE = int(os.getenv("DECODE_SCALE", "1"))  # Decode snapshots at 1/N size: 1, 2, 4 or 8
     
     # Output Settings
     OUTPUT_BASE_DIR = os.getenv("OUTPUT_BASE_DIR", "output")
@@ -53,6 +72,7 @@ class Config:
     DB_NAME = os.getenv("DB_NAME", "crowd_counter")
     DB_USER = os.getenv("DB_USER", "postgres")
     DB_PASS = os.getenv("DB_PASS", "")
+    DB_SSLMODE = os.getenv("DB_SSLMODE", "prefer")  # "disable" skips the TLS handshake on a trusted LAN
     
     # Preset Configuration
     PRESET_CONFIG_FILE = os.getenv("PRESET_CONFIG_FILE", "preset_config.json")
@@ -75,6 +95,16 @@ class Config:
         if not os.path.exists(cls.PRESET_CONFIG_FILE):
             errors.append(f"Preset config not found at: {cls.PRESET_CONFIG_FILE}")
         
+        # Check decode scale
+        if cls.DECODE_SCALE not in (1, 2, 4, 8):
+            errors.append(f"DECODE_SCALE must be 1, 2, 4 or 8, got {cls.DECODE_SCALE}")
+        
+        # Check export format
+        if cls.MODEL_EXPORT_FORMAT and cls.MODEL_EXPORT_FORMAT not in EXPORT_SUFFIXES:
+            errors.append(
+                f"MODEL_EXPORT_FORMAT must be one of {', '.join(EXPORT_SUFFIXES)}, got {cls.MODEL_EXPORT_FORMAT}"
+            )
+        
         # Check email configuration
         if cls.EMAIL_API == "YOUR_MAILTRAP_API_KEY":
             warnings.append("Email API key not set. Email functionality will fail.")
@@ -109,7 +139,8 @@ class Config:
             "conf": cls.INFER_CONF,
             "iou": cls.INFER_IOU,
             "cluster_eps": cls.CLUSTER_EPS,
-            "min_cluster_size": cls.MIN_CLUSTER_SIZE
+            "min_cluster_size": cls.MIN_CLUSTER_SIZE,
+            "batch_size": cls.BATCH_SIZE
         }
     
     @classmethod
@@ -129,7 +160,8 @@ class Config:
             "port": cls.DB_PORT,
             "name": cls.DB_NAME,
             "user": cls.DB_USER,
-            "password": cls.DB_PASS
+            "password": cls.DB_PASS,
+            "sslmode": cls.DB_SSLMODE
         }
     
     @classmethod
@@ -138,7 +170,7 @@ class Config:
         logger.info("Configuration Summary:")
         logger.info(f"  Camera: {cls.CAMERA_IP}:{cls.VISCA_PORT}")
         logger.info(f"  Model: {cls.MODEL_PATH}")
-        logger.info(f"  Workers: {cls.NUM_WORKERS}")
+        logger.info(f"  Workers: {cls.NUM_WORKERS} (batch size {cls.BATCH_SIZE})")
         logger.info(f"  Output: {cls.OUTPUT_BASE_DIR}")
 
 
@@ -150,26 +182,31 @@ class PresetConfig:
             config_file = Config.PRESET_CONFIG_FILE
         
         self.config_file = config_file
-        self.presets = []
+        self.presets = ()
         self.preset_map = {}
+        self._preset_tuples = ()
+        self._preset_map_view = types.MappingProxyType(self.preset_map)
         self._load()
     
     def _load(self):
         """Load preset configuration from JSON file."""
         try:
-            with open(self.config_file, "r") as f:
-                config = json.load(f)
+            with open(self.config_file, "rb") as f:
+                config = orjson.loads(f.read())
                 presets_data = config.get("presets", [])
-                self.presets = [preset["number"] for preset in presets_data]
+                self.presets = tuple(preset["number"] for preset in presets_data)
                 self.preset_map = {
                     preset["number"]: preset.get("name", f"Preset {preset['number']}")
                     for preset in presets_data
                 }
+                # Read-only views shared with callers, built once
+                self._preset_tuples = tuple((p, self.preset_map[p]) for p in self.presets)
+                self._preset_map_view = types.MappingProxyType(self.preset_map)
                 logger.debug(f"Loaded {len(self.presets)} presets from {self.config_file}")
         except FileNotFoundError:
             logger.error(f"Preset configuration file not found: {self.config_file}")
             raise
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Invalid JSON in preset configuration: {str(e)}")
             raise
         except Exception as e:
@@ -177,8 +214,8 @@ class PresetConfig:
             raise
     
     def get_presets(self):
-        """Get list of (preset_number, preset_name) tuples."""
-        return [(p, self.preset_map.get(p, f"Preset {p}")) for p in self.presets]
+        """Get a tuple of (preset_number, preset_name) pairs, built once at load."""
+        return self._preset_tuples
     
     def get_preset_name(self, preset_number):
         """Get the name for a specific preset number."""
@@ -189,5 +226,5 @@ class PresetConfig:
         return self.presets
     
     def get_preset_map(self):
-        """Get the full preset number -> name mapping."""
-        return self.preset_map
+        """Get a read-only view of the preset number -> name mapping."""
+        return self._preset_map_view
@@ -1,14 +1,32 @@
 """Database operations for crowd counter attendance tracking."""
-import json
 import logging
 import os
 from datetime import datetime
+import orjson
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from .config import Config
 
 logger = logging.getLogger(__name__)
 
+# Attendance column per service hour. This is also the API's allow-list for
+# service/hour values; only these trusted column names are ever put into SQL
+SERVICE_COLUMNS = {
+    "9am": "service_9am_sanctuary",
+    "1045am": "service_1045am_sanctuary"
+}
+
+# Upsert per service hour, built once at import. date is UNIQUE, and
+# xmax = 0 only for a freshly inserted row (weather and temp stay NULL)
+ATTENDANCE_UPSERT_SQL = {
+    hour: (
+        f"INSERT INTO attendance (date, {column}) VALUES (%s, %s) "
+        f"ON CONFLICT (date) DO UPDATE SET {column} = EXCLUDED.{column} "
+        "RETURNING (xmax = 0) AS inserted"
+    )
+    for hour, column in SERVICE_COLUMNS.items()
+}
+
 
 class AttendanceDatabase:
     """Handles attendance data storage in PostgreSQL."""
@@ -24,7 +42,8 @@ class AttendanceDatabase:
                 port=self.db_config["port"],
                 database=self.db_config["name"],
                 user=self.db_config["user"],
-                password=self.db_config["password"]
+                password=self.db_config["password"],
+                sslmode=self.db_config["sslmode"]
             )
             return conn
         except Exception as e:
@@ -47,8 +66,8 @@ class AttendanceDatabase:
 
         try:
             # Read last_run.json
-            with open(last_run_path, 'r') as f:
-                data = json.load(f)
+            with open(last_run_path, 'rb') as f:
+                data = orjson.loads(f.read())
 
             # Check if hour is specified
             if 'hour' not in data:
@@ -60,13 +79,10 @@ class AttendanceDatabase:
             today = datetime.now().strftime('%m/%d/%Y')  # MM/DD/YYYY format
 
             # Determine column based on hour
-            if hour == '9am':
-                column = 'service_9am_sanctuary'
-            elif hour == '1045am':
-                column = 'service_1045am_sanctuary'
-            else:
+            if hour not in SERVICE_COLUMNS:
                 logger.warning(f"Unknown hour '{hour}', expected '9am' or '1045am'")
                 return False
+            column = SERVICE_COLUMNS[hour]
 
             # Update database
             conn = self._get_connection()
@@ -75,27 +91,12 @@ class AttendanceDatabase:
 
             try:
                 with conn.cursor() as cursor:
-                    # Check if row exists for today
-                    cursor.execute(
-                        "SELECT date FROM attendance WHERE date = %s",
-                        (today,)
-                    )
-                    exists = cursor.fetchone() is not None
-
-                    if exists:
-                        # Update existing row
-                        cursor.execute(
-                            f"UPDATE attendance SET {column} = %s WHERE date = %s",
-                            (total_count, today)
-                        )
-                        logger.info(f"Updated attendance for {today}: {column} = {total_count}")
-                    else:
-                        # Insert new row (weather and temp will be NULL)
-                        cursor.execute(
-                            f"INSERT INTO attendance (date, {column}) VALUES (%s, %s)",
-                            (today, total_count)
-                        )
+                    # Insert today's row or update it in place
+                    cursor.execute(ATTENDANCE_UPSERT_SQL[hour], (today, total_count))
+                    if cursor.fetchone()[0]:
                         logger.info(f"Created new attendance record for {today}: {column} = {total_count}")
+                    else:
+                        logger.info(f"Updated attendance for {today}: {column} = {total_count}")
 
                     conn.commit()
                     return True
@@ -1,171 +1,494 @@
 """Image processing with YOLO inference and clustering."""
+import functools
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
-from sklearn.cluster import DBSCAN
 from ultralytics import YOLO
-from .config import Config, PresetConfig
+from .config import EXPORT_SUFFIXES, Config, PresetConfig
 
 
 logger = logging.getLogger(__name__)
 
 
+# cv2.imdecode flag per DECODE_SCALE: libjpeg scales in the DCT domain, so a
+# reduced decode skips most of the work for pixels YOLO would discard anyway
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+def export_model(model_path, export_format, batch_size, int8_data=None):
+    """
+    Export model_path to an accelerated format once and return the path to load.
+
+    The export is cached next to the .pt file and reused until the .pt
+    changes. Returns model_path unchanged when no format is set or the
+    export fails.
+
+    int8_data is a dataset YAML of representative captures; when set,
+    engine and openvino exports are quantized to INT8 calibrated on it,
+    falling back to the default precision if calibration fails.
+    """
+    if not export_format:
+        return model_path
+
+    suffixes = [EXPORT_SUFFIXES[export_format]]
+    if int8_data and export_format == "openvino":
+        # Ultralytics names INT8 OpenVINO exports apart; the plain one is the calibration fallback
+        suffixes.insert(0, "_int8_openvino_model")
+    for suffix in suffixes:
+        exported_path = os.path.splitext(model_path)[0] + suffix
+        if os.path.exists(exported_path) and os.path.getmtime(exported_path) >= os.path.getmtime(model_path):
+            logger.info(f"Using cached {export_format} model: {exported_path}")
+            return exported_path
+
+    options = dict(
+        format=export_format,
+        half=export_format == "engine",  # FP16 TensorRT engine
+        dynamic=True,
+        batch=batch_size,
+        imgsz=640
+    )
+    if export_format == "engine":
+        options["workspace"] = 4  # TensorRT builder memory, GiB
+
+    if int8_data and export_format in ("engine", "openvino"):
+        logger.info(f"Exporting {model_path} to INT8 {export_format} calibrated on {int8_data} (one-time)...")
+        try:
+            return YOLO(model_path).export(**options, int8=True, data=int8_data)
+        except Exception as e:
+            logger.warning(f"⚠️  INT8 calibration failed, exporting at default precision: {str(e)}")
+
+    logger.info(f"Exporting {model_path} to {export_format} (one-time)...")
+    try:
+        return YOLO(model_path).export(**options)
+    except Exception as e:
+        logger.warning(f"⚠️  Model export to {export_format} failed, using {model_path}: {str(e)}")
+        return model_path
+
+
+def cuda_available():
+    """Return True if torch is installed and can see a CUDA device."""
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+def load_model(model_path):
+    """
+    Load a YOLO model for inference.
+
+    On a GPU, a PyTorch (.pt) model has its conv and batch-norm layers fused
+    and is run in FP16; exported models already carry their own precision.
+
+    Returns:
+        tuple: (model, half) where half says whether to predict in FP16
+    """
+    model = YOLO(model_path)
+    on_gpu = cuda_available()
+    if on_gpu:
+        import torch
+        # Let any remaining FP32 matmuls use TF32 tensor cores, and let cuDNN
+        # pick and cache the fastest kernels: every frame from the camera has
+        # the same shape
+        torch.set_float32_matmul_precision("high")
+        torch.backends.cudnn.benchmark = True
+    half = on_gpu and model_path.endswith(".pt")
+    if half:
+        model.fuse()
+        logger.info("Fused model layers; running FP16 inference on GPU")
+    return model, half
+
+
+@functools.lru_cache(maxsize=None)
+def annotated_dir(output_dir):
+    """Return output_dir's annotated_images directory, creating it on the first call only."""
+    path = os.path.join(output_dir, "annotated_images")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def count_clusters(centers, eps, min_samples):
+    """
+    Count DBSCAN clusters of 1-D points with a sort and scan.
+
+    A point is a core point when at least min_samples points (itself
+    included) lie within eps of it. In 1-D, core points chain into one
+    cluster exactly when consecutive sorted core points are at most eps
+    apart, so the cluster count is the number of gaps wider than eps plus
+    one. This gives the same count as sklearn's DBSCAN without building a
+    neighbor index.
+    """
+    x = np.sort(centers)
+    neighbors = np.searchsorted(x, x + eps, side="right") - np.searchsorted(x, x - eps, side="left")
+    core = x[neighbors >= min_samples]
+    if core.size == 0:
+        return 0
+    return 1 + int(np.count_nonzero(np.diff(core) > eps))
+
+
+def count_and_annotate(preset_number, preset_name, img, result, output_dir,
+                       cluster_eps, min_cluster_size):
+    """
+    Cluster one image's detections, annotate img in place, save it and build its result dict.
+    """
+    boxes = (
+        result.boxes.xyxy.cpu().numpy()
+        if len(result.boxes) > 0
+        else np.empty((0, 4), dtype=np.float32)
+    )
+
+    # Cluster & count; below min_cluster_size (including empty and
+    # single-detection frames) each box counts as-is, so skip clustering
+    count = len(boxes)
+    if count >= min_cluster_size and count > 1:
+        # Back to full-resolution pixels so CLUSTER_EPS means the same at any DECODE_SCALE
+        centers = (boxes[:, 0] + boxes[:, 2]) * (0.5 * Config.DECODE_SCALE)
+        count = count_clusters(centers, cluster_eps, min_cluster_size)
+
+    # Draw boxes & count straight onto the decoded frame (it isn't used
+    # afterwards); cast all corners to int once instead of per box
+    for x1, y1, x2, y2 in boxes[:, :4].astype(np.int32).tolist():
+        cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(
+            img,
+            "Person",
+            (x1, y1 - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5,
+            (0, 255, 0),
+            2
+        )
+    cv2.putText(
+        img,
+        f"Count: {count}",
+        (10, 30),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        1,
+        (0, 0, 255),
+        2
+    )
+
+    # Build output filename
+    annotated_filename = f"{preset_name.replace(' ', '_')}_{preset_number:03d}.jpg"
+    annotated_path = os.path.join(annotated_dir(output_dir), annotated_filename)
+    # Encode once in memory: the same JPEG bytes go to disk and, via the
+    # result, straight into the report zip without reading the file back
+    ok, jpeg = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
+    if not ok:
+        raise RuntimeError("Failed to encode annotated image")
+    jpeg_bytes = jpeg.tobytes()
+    with open(annotated_path, "wb") as f:
+        f.write(jpeg_bytes)
+    logger.info(
+        f"Saved annotated image to {annotated_path}, Count: {count}"
+    )
+
+    return {
+        "preset": f"{preset_number:03d}",
+        "preset_number": preset_number,
+        "name": preset_name,
+        "count": count,
+        "annotated_path": annotated_path,
+        "jpeg_bytes": jpeg_bytes
+    }
+
+
+def error_result(preset_number, error):
+    """Build the result dict for a preset that couldn't be processed."""
+    return {
+        "preset": f"{preset_number:03d}",
+        "preset_number": preset_number,
+        "count": 0,
+        "error": error
+    }
+
+
+def annotate_and_put(preset_number, preset_name, img, result, result_queue,
+                     output_dir, cluster_eps, min_cluster_size):
+    """Run count_and_annotate for one image and push its result (or error) to result_queue."""
+    try:
+        result_queue.put(count_and_annotate(
+            preset_number, preset_name, img, result, output_dir,
+            cluster_eps, min_cluster_size
+        ))
+    except Exception as e:
+        logger.error(f"Error processing preset {preset_number}: {str(e)}")
+        result_queue.put(error_result(preset_number, str(e)))
+
+
+def decode_jpeg(jpeg_bytes):
+    """Decode JPEG bytes into a BGR frame at 1/DECODE_SCALE size, or None if they can't be decoded."""
+    return cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), DECODE_FLAGS[Config.DECODE_SCALE])
+
+
+def capture_handler(image_queue, in_process):
+    """
+    Return the on_capture callback that queues captures for the workers.
+
+    The in-process worker shares this process's memory, so frames are
+    decoded here, while the camera settles on the next preset, and queued
+    as arrays. Worker processes get the JPEG bytes instead, since a few
+    hundred KB pickles far faster than a decoded frame.
+    """
+    if not in_process:
+        return image_queue.put
+
+    def on_capture(capture):
+        preset_number, preset_name, jpeg_bytes = capture
+        image_queue.put((preset_number, preset_name, decode_jpeg(jpeg_bytes)))
+
+    return on_capture
+
+
+def decode_captures(captures, pool=None):
+    """
+    Return captures with any JPEG bytes replaced by decoded frames (None if undecodable).
+
+    cv2.imdecode releases the GIL, so with pool a batch's images decode in
+    parallel; otherwise they decode one after another.
+    """
+    images = [image for _, _, image in captures]
+    encoded = [i for i, image in enumerate(images) if isinstance(image, bytes)]
+    if encoded:
+        decode = pool.map if pool is not None else map
+        for i, img in zip(encoded, decode(decode_jpeg, [images[i] for i in encoded])):
+            images[i] = img
+    return [(n, name, img) for (n, name, _), img in zip(captures, images)]
+
+
+def read_batches(image_queue, batch_size, decoded, decode_pool=None):
+    """
+    Decoder stage of a worker: group queued captures into batches of up to
+    batch_size, decode them (on decode_pool when given) and put each batch
+    on decoded, then None once the worker's stop signal arrives.
+    """
+    stopping = False
+    while not stopping:
+        capture = image_queue.get()
+        if capture is None:
+            break
+
+        # Fill the batch with whatever else is already queued
+        batch = [capture]
+        while len(batch) < batch_size:
+            try:
+                capture = image_queue.get_nowait()
+            except queue.Empty:
+                break
+            if capture is None:
+                stopping = True
+                break
+            batch.append(capture)
+
+        decoded.put(decode_captures(batch, decode_pool))
+    decoded.put(None)
+
+
+def process_batch(model, captures, result_queue, output_dir,
+                  infer_conf, infer_iou, cluster_eps, min_cluster_size,
+                  annotate_pool=None, half=False):
+    """
+    Run one YOLO prediction over a batch of captures and push a result per image.
+
+    captures are (preset_number, preset_name, image) tuples, where image is
+    the camera's JPEG bytes (decoded here, once, in memory) or a frame
+    already decoded by capture_handler.
+
+    With annotate_pool, clustering, drawing and JPEG encoding are handed to
+    the pool so they overlap the next batch's inference; OpenCV releases the
+    GIL for those calls. Otherwise they run here before returning.
+    """
+    logger.info(f"Processing batch of {len(captures)} image(s)")
+
+    loaded = []
+    for preset_number, preset_name, img in decode_captures(captures):
+        if img is None:
+            logger.error(f"Failed to decode image for preset {preset_number}")
+            result_queue.put(error_result(preset_number, "Failed to decode image"))
+        else:
+            loaded.append((preset_number, preset_name, img))
+    if not loaded:
+        return
+
+    try:
+        # Run inference on the whole batch at once
+        results = model.predict(
+            [img for _, _, img in loaded], conf=infer_conf, iou=infer_iou, half=half, verbose=False
+        )
+    except Exception as e:
+        logger.error(f"Error running inference on batch: {str(e)}")
+        for preset_number, _, _ in loaded:
+            result_queue.put(error_result(preset_number, str(e)))
+        return
+
+    for (preset_number, preset_name, img), result in zip(loaded, results):
+        args = (preset_number, preset_name, img, result, result_queue,
+                output_dir, cluster_eps, min_cluster_size)
+        if annotate_pool is not None:
+            annotate_pool.submit(annotate_and_put, *args)
+        else:
+            annotate_and_put(*args)
+
+
 def process_image_worker(image_queue, result_queue, model_path, output_dir, 
-                        infer_conf, infer_iou, cluster_eps, min_cluster_size):
+                        infer_conf, infer_iou, cluster_eps, min_cluster_size,
+                        batch_size=1, num_threads=None, log_queue=None):
     """
     Worker function to process images:
-    - Runs YOLO inference
+    - Takes up to batch_size queued (preset_number, preset_name, jpeg_bytes)
+      captures at a time and decodes them on a reader thread, one batch
+      ahead of inference
+    - Runs YOLO inference on them in one call
     - Clusters detections
-    - Annotates images
+    - Annotates images on a thread pool while the next batch is inferred
     - Sends results to result_queue
+
+    num_threads caps torch's intra-op threads and the decode and annotation
+    pools, so several worker processes share the CPU instead of each
+    claiming all of it.
+    With log_queue, records bound for the log file are sent to the main
+    process's listener instead of each worker writing the file itself.
     """
+    if log_queue is not None:
+        root = logging.getLogger()
+        for handler in [h for h in root.handlers if isinstance(h, logging.FileHandler)]:
+            root.removeHandler(handler)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+
     logger.info("Starting image processing worker")
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+    pool_size = num_threads or os.cpu_count() or 1
+    decode_pool = ThreadPoolExecutor(max_workers=pool_size)
+    annotate_pool = ThreadPoolExecutor(max_workers=pool_size)
+
+    # Decode the next batch while the current one is inferred; the bound
+    # keeps the reader at most one batch ahead
+    decoded = queue.Queue(maxsize=1)
+    reader = threading.Thread(
+        target=read_batches, args=(image_queue, batch_size, decoded, decode_pool), daemon=True
+    )
+    reader.start()
+
+    # Load the model once per worker and run a dummy inference so the
+    # first real image doesn't pay for lazy initialization
+    model, half = load_model(model_path)
+    model.predict(np.zeros((640, 640, 3), dtype=np.uint8), half=half, verbose=False)
     
-    while True:
-        image_path = image_queue.get()
-        if image_path is None:
-            logger.info("Worker received stop signal")
-            break
-        
-        try:
-            logger.info(f"Processing image: {image_path}")
-            model = YOLO(model_path)
-
-            img = cv2.imread(image_path)
-            if img is None:
-                logger.error(f"Failed to load image: {image_path}")
-                result_queue.put({
-                    "preset": os.path.basename(image_path),
-                    "count": 0,
-                    "error": "Failed to load image"
-                })
-                continue
-
-            # Run inference
-            results = model.predict(img, conf=infer_conf, iou=infer_iou, verbose=False)
-            boxes = (
-                results[0].boxes.xyxy.cpu().numpy()
-                if len(results[0].boxes) > 0
-                else np.array([])
-            )
-
-            # Cluster & count
-            count = 0
-            if len(boxes) > 0:
-                centers = np.array([(box[0] + box[2]) / 2 for box in boxes])
-                if len(centers) >= min_cluster_size:
-                    clustering = DBSCAN(
-                        eps=cluster_eps,
-                        min_samples=min_cluster_size
-                    ).fit(centers.reshape(-1, 1))
-                    count = len(set(clustering.labels_)) - (1 if -1 in clustering.labels_ else 0)
-                else:
-                    count = len(centers)
-
-            # Draw boxes & count
-            annotated_img = img.copy()
-            for box in boxes:
-                x1, y1, x2, y2 = map(int, box[:4])
-                cv2.rectangle(annotated_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(
-                    annotated_img,
-                    "Person",
-                    (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.5,
-                    (0, 255, 0),
-                    2
-                )
-            cv2.putText(
-                annotated_img,
-                f"Count: {count}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                1,
-                (0, 0, 255),
-                2
-            )
-
-            # Extract preset number and name from filename
-            filename = os.path.basename(image_path)
-            name_part = filename.removeprefix("preset_").rsplit(".", 1)[0]
-            preset_num, preset_name_safe = name_part.split("_", 1)
-            
-            # Build output filename
-            annotated_filename = f"{preset_name_safe}_{preset_num}.jpg"
-            annotated_path = os.path.join(
-                output_dir,
-                "annotated_images",
-                annotated_filename
-            )
-            os.makedirs(os.path.dirname(annotated_path), exist_ok=True)
-            cv2.imwrite(
-                annotated_path,
-                annotated_img,
-                [int(cv2.IMWRITE_JPEG_QUALITY), 70]
-            )
-            logger.info(
-                f"Saved annotated image to {annotated_path}, Count: {count}"
-            )
-
-            # Push result
-            result_queue.put({
-                "preset": preset_num,
-                "name": preset_name_safe.replace("_", " "),
-                "count": count,
-                "annotated_path": annotated_path
-            })
+    while (batch := decoded.get()) is not None:
+        process_batch(model, batch, result_queue, output_dir,
+                      infer_conf, infer_iou, cluster_eps, min_cluster_size,
+                      annotate_pool, half)
+
+    logger.info("Worker received stop signal")
+    decode_pool.shutdown(wait=True)
+    # Let pending annotations push their results before the worker exits
+    annotate_pool.shutdown(wait=True)
 
-        except Exception as e:
-            logger.error(f"Error processing {image_path}: {str(e)}")
-            result_queue.put({
-                "preset": os.path.basename(image_path),
-                "count": 0,
-                "error": str(e)
-            })
+
+def use_in_process_worker(num_workers):
+    """
+    Decide whether to run inference in one thread of this process.
+
+    A GPU serializes predictions anyway, so with a GPU (or a single worker)
+    one in-process thread replaces the worker processes. It reuses the
+    modules this process already imported instead of spawning processes
+    that each import torch and load the model, and results need no pickling.
+    """
+    return num_workers == 1 or cuda_available()
 
 
 def start_processing_workers(num_workers, image_queue, result_queue, 
                             model_path, output_dir, infer_conf, infer_iou,
-                            cluster_eps, min_cluster_size):
+                            cluster_eps, min_cluster_size, batch_size=1,
+                            in_process=False, log_queue=None):
     """
-    Start worker processes for image processing.
+    Start workers for image processing.
+
+    With in_process (see use_in_process_worker) a single thread runs all
+    inference; pass plain queue.Queue objects in that case. log_queue is
+    handed to worker processes for file logging (see process_image_worker).
     
     Returns:
-        list: List of worker Process objects
+        list: List of worker Process (or Thread) objects
     """
     from multiprocessing import Process
-    
+
+    args = (image_queue, result_queue, model_path, output_dir,
+            infer_conf, infer_iou, cluster_eps, min_cluster_size,
+            batch_size)
+
+    if in_process:
+        logger.info("Starting 1 in-process image processing worker")
+        worker = threading.Thread(target=process_image_worker, args=args, daemon=True)
+        worker.start()
+        return [worker]
+
+    # Split the cores between worker processes. The env vars reach the
+    # OpenMP/BLAS pools of freshly started interpreters; the explicit
+    # num_threads covers torch when it was already imported (forkserver).
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+
     workers = []
-    logger.info(f"Starting {num_workers} image processing workers")
+    logger.info(f"Starting {num_workers} image processing workers ({num_threads} thread(s) each)")
     
     for _ in range(num_workers):
-        p = Process(
-            target=process_image_worker,
-            args=(image_queue, result_queue, model_path, output_dir,
-                  infer_conf, infer_iou, cluster_eps, min_cluster_size)
-        )
+        p = Process(target=process_image_worker, args=args + (num_threads, log_queue))
         p.start()
         workers.append(p)
     
     return workers
 
 
-def stop_workers(workers, image_queue, num_workers):
-    """Send stop signals and wait for workers to complete."""
+def send_stop_signals(workers, image_queue):
+    """
+    Queue one stop signal per worker behind the captures already queued.
+
+    Sent before collect_results, so surviving workers drain the queue and
+    exit even if one of them dies holding captures; collect_results then
+    stops once every worker has exited instead of waiting forever.
+    """
     logger.info("Sending stop signals to workers")
-    for _ in range(num_workers):
+    for _ in workers:
         image_queue.put(None)
-    
+
+
+def stop_workers(workers):
+    """Wait for workers to complete; call after collect_results has drained their results."""
     for w in workers:
         w.join()
     logger.info("All processing workers have completed")
 
 
-def collect_results(result_queue):
-    """Collect all results from the result queue."""
+def collect_results(result_queue, expected, workers):
+    """
+    Collect the expected number of results from the result queue.
+
+    Workers push exactly one result per queued image, so this blocks until
+    that many have arrived rather than trusting Queue.empty(), which can
+    report empty while results are still in flight. Stops early only if
+    every worker has exited, so send_stop_signals must come first.
+    """
     results = []
-    while not result_queue.empty():
-        results.append(result_queue.get())
+    while len(results) < expected:
+        try:
+            results.append(result_queue.get(timeout=1))
+        except queue.Empty:
+            if not any(w.is_alive() for w in workers):
+                logger.error(f"Workers exited with {expected - len(results)} result(s) missing")
+                break
     return results
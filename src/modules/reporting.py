@@ -6,13 +6,31 @@ import os
 import zipfile
 from datetime import datetime
 from .config import Config, PresetConfig
-import json  # Add this import at the top with other imports
+import orjson
+import mailtrap as mt
 
+logger = logging.getLogger(__name__)
 
 
-import mailtrap as mt
+def encode_file_base64(path):
+    """
+    Base64-encode a file for a mailtrap attachment.
+
+    Returns bytes, the type mt.Attachment stores, so the SDK keeps the
+    buffer as is instead of converting it.
+    """
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read())
 
-logger = logging.getLogger(__name__)
+
+def _iter_files(root):
+    """Yield the path of every file under root, using os.scandir's cached entry types."""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield from _iter_files(entry.path)
+            else:
+                yield entry.path
 
 
 class ReportGenerator:
@@ -37,32 +55,33 @@ class ReportGenerator:
         """
         csv_path = os.path.join(self.results_dir, "count_results.csv")
         
-        total_count = 0
+        # Workers finish in any order; list presets in number order
+        ok = sorted(
+            (r for r in results if "count" in r and "error" not in r),
+            key=lambda r: r["preset_number"]
+        )
+        rows = [
+            (r["preset"], preset_map.get(r["preset_number"], f"Preset {r['preset_number']}"), r["count"])
+            for r in ok
+        ]
+        total_count = sum(row[2] for row in rows)
         with open(csv_path, "w", newline="") as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow(["Preset", "Name", "Count"])
-            
-            for r in results:
-                if "count" in r and "error" not in r:
-                    total_count += r["count"]
-                    preset_num = r["preset"].split('_')[0] if '_' in r["preset"] else r["preset"]
-                    preset_num_int = int(preset_num)
-                    writer.writerow([
-                        preset_num,
-                        preset_map.get(preset_num_int, f"Preset {preset_num}"),
-                        r["count"]
-                    ])
+            writer.writerows(rows)
         
         logger.info(f"Results saved to {csv_path} with total count: {total_count}")
         return csv_path, total_count
     
-    def create_zip(self, annotated_dir, csv_path):
+    def create_zip(self, annotated_dir, csv_path, images=None):
         """
         Create a zip file containing annotated images and CSV results.
         
         Args:
             annotated_dir: Directory containing annotated images
             csv_path: Path to CSV results file
+            images: Optional list of (annotated_path, jpeg_bytes) already in
+                memory; written directly instead of re-reading annotated_dir
         
         Returns:
             str: Path to created zip file
@@ -70,18 +89,23 @@ class ReportGenerator:
         zip_path = os.path.join(self.output_dir, f"ptz_capture_results_{self.run_id}.zip")
         logger.info(f"Creating zip file: {zip_path}")
         
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        # JPEGs are already compressed, so store them as-is; only the CSV is deflated
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zipf:
             # Add annotated images
-            for root, _, files in os.walk(annotated_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
+            if images is not None:
+                for file_path, jpeg_bytes in images:
+                    arcname = os.path.relpath(file_path, start=self.output_dir)
+                    zipf.writestr(arcname, jpeg_bytes)
+                    logger.debug(f"Added {arcname} to zip")
+            else:
+                for file_path in _iter_files(annotated_dir):
                     arcname = os.path.relpath(file_path, start=self.output_dir)
                     zipf.write(file_path, arcname)
                     logger.debug(f"Added {arcname} to zip")
             
             # Add CSV
             arcname = os.path.relpath(csv_path, start=self.output_dir)
-            zipf.write(csv_path, arcname)
+            zipf.write(csv_path, arcname, compress_type=zipfile.ZIP_DEFLATED, compresslevel=6)
             logger.debug(f"Added {arcname} to zip")
         
         logger.info(f"Zip file created successfully: {zip_path}")
@@ -112,20 +136,17 @@ class EmailNotifier:
         logger.info(f"Preparing email with attachment: {zip_path}")
         
         # Format datetime for display
-        run_datetime = datetime.strptime(run_id, "%Y%m%d_%H%M%S").strftime("%B %d, %Y at %I:%M %p")
-        run_date = datetime.strptime(run_id, "%Y%m%d_%H%M%S").strftime("%B %d, %Y")
+        run_dt = datetime.strptime(run_id, "%Y%m%d_%H%M%S")
+        run_datetime = run_dt.strftime("%B %d, %Y at %I:%M %p")
+        run_date = run_dt.strftime("%B %d, %Y")
         
         # Build email body
         body = self._build_email_body(run_datetime, total_count)
         
         try:
             # Read and encode zip file
-            with open(zip_path, "rb") as zip_file:
-                zip_content = zip_file.read()
-            logger.info(f"Read zip file: {len(zip_content)} bytes")
-            
-            zip_content_base64 = base64.b64encode(zip_content)
-            logger.debug("Encoded zip content to base64")
+            zip_content_base64 = encode_file_base64(zip_path)
+            logger.info(f"Encoded zip file: {os.path.getsize(zip_path)} bytes")
             
             # Parse recipients
             email_recipients = [email.strip() for email in receivers.split(',') if email.strip()]
@@ -209,7 +230,9 @@ def generate_report(output_dir, run_id, results, preset_map,
     email_sent = False
     
     if os.path.exists(annotated_dir):
-        zip_path = reporter.create_zip(annotated_dir, csv_path)
+        # Annotated JPEGs handed back by the workers, so the zip needn't re-read them
+        images = [(r["annotated_path"], r["jpeg_bytes"]) for r in results if "jpeg_bytes" in r]
+        zip_path = reporter.create_zip(annotated_dir, csv_path, images)
         
         # Send email if requested
         if send_email and email_config and zip_path:
@@ -244,8 +267,8 @@ def generate_report(output_dir, run_id, results, preset_map,
 
     # Export to last_run.json
     last_run_path = os.path.join(os.path.dirname(output_dir), "last_run.json")
-    with open(last_run_path, "w") as json_file:
-        json.dump(report_data, json_file, indent=4)
+    with open(last_run_path, "wb") as json_file:
+        json_file.write(orjson.dumps(report_data))
     logger.info(f"Exported last run data to {last_run_path}")
     
     return report_data
\ No newline at end of file